@@ -0,0 +1,246 @@
+"""
+Benchmarks for the rendering hot paths of django-wms.
+
+Creates a test database with a synthetic grid of polygons and measures map
+construction, symbol set creation, layer dispatch with a large cartography,
+GetMap requests of several sizes, the tile cache hit, miss and empty tile
+paths and GetCapabilities requests for maps with many layers.
+
+Run from the repository root with:
+
+    PYTHONPATH=. DJANGO_SETTINGS_MODULE=settings python benchmarks/hot_paths.py [options]
+
+Use --save to store the results as baseline and --baseline to compare a run
+against it. The script exits with an error if the median time of any
+benchmark grew beyond the tolerance.
+"""
+import argparse
+import json
+import sys
+import time
+
+import django
+
+# Allowed ratio between the median time of a run and of the baseline
+TOLERANCE = 1.5
+
+# Area covered by the synthetic polygons, in longitude and latitude
+EXTENT = (5.0, 45.0, 11.0, 48.0)
+
+
+def create_polygons(count):
+    """
+    Creates a grid of count square polygons covering the benchmark extent.
+    """
+    from tests.models import TestPolygon
+
+    side = max(int(count ** 0.5), 1)
+    width = (EXTENT[2] - EXTENT[0]) / side
+    height = (EXTENT[3] - EXTENT[1]) / side
+    polygons = []
+    for i in range(count):
+        x0 = EXTENT[0] + (i % side) * width
+        y0 = EXTENT[1] + (i // side % side) * height
+        x1, y1 = x0 + width * 0.9, y0 + height * 0.9
+        polygons.append(TestPolygon(geom='POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(x0, y0, x1, y1)))
+    TestPolygon.objects.bulk_create(polygons, batch_size=1000)
+
+
+def get_cartography(count):
+    """
+    Returns a cartography with count categories.
+    """
+    return [{
+        'name': 'Category {0}'.format(i),
+        'expression': '([id] = {0})'.format(i),
+        'color': '{0} {1} {2}'.format(i % 256, (i * 7) % 256, (i * 13) % 256),
+        'symbol': 'hatch' if i % 2 else 'cross',
+    } for i in range(count)]
+
+
+def build_classes(options):
+    """
+    Returns the layer, map and view classes used in the benchmarks.
+    """
+    from tests.models import TestPolygon
+    from wms.cache import MemoryTileCache
+    from wms.layers import WmsVectorLayer
+    from wms.maps import WmsMap
+    from wms.views import WmsView
+
+    class BenchLayer(WmsVectorLayer):
+        model = TestPolygon
+        name = 'bench'
+        cartography = get_cartography(options.classes)
+
+    class BenchMap(WmsMap):
+        layer_classes = [BenchLayer]
+
+    class CapabilitiesMap(WmsMap):
+        layer_classes = [
+            type('BenchLayer{0}'.format(i), (BenchLayer,), {'name': 'bench{0}'.format(i)})
+            for i in range(options.layers)
+        ]
+
+    class BenchView(WmsView):
+        map_class = BenchMap
+
+        def tile_exists(self, x, y, z):
+            return True
+
+    class CachedBenchView(BenchView):
+        tile_cache = MemoryTileCache()
+
+    class EmptyBenchView(BenchView):
+
+        def tile_exists(self, x, y, z):
+            return False
+
+    class CapabilitiesView(WmsView):
+        map_class = CapabilitiesMap
+
+    return {
+        'layer': BenchLayer,
+        'map': BenchMap,
+        'view': BenchView,
+        'cached_view': CachedBenchView,
+        'empty_view': EmptyBenchView,
+        'capabilities_view': CapabilitiesView,
+    }
+
+
+def get_benchmarks(options):
+    """
+    Returns a list of (name, function) pairs, each function runs one
+    iteration of the benchmark.
+    """
+    from django.test.client import RequestFactory
+    from wms.symbols import WmsSymbolSet
+
+    classes = build_classes(options)
+    factory = RequestFactory()
+    request = factory.get('/wms/')
+    view = classes['view'].as_view()
+    cached_view = classes['cached_view'].as_view()
+    empty_view = classes['empty_view'].as_view()
+    capabilities_view = classes['capabilities_view'].as_view()
+
+    def check(response):
+        if response.status_code != 200:
+            raise RuntimeError('Unexpected status code {0}'.format(response.status_code))
+
+    def getmap(size):
+        url = (
+            '/wms/?SERVICE=WMS&REQUEST=GetMap&VERSION=1.1.1&LAYERS=bench&STYLES=&FORMAT=image%2Fpng'
+            '&SRS=EPSG%3A4326&BBOX={0},{1},{2},{3}&WIDTH={4}&HEIGHT={4}'
+        ).format(EXTENT[0], EXTENT[1], EXTENT[2], EXTENT[3], size)
+        return lambda: check(view(factory.get(url)))
+
+    def tile(view, **kwargs):
+        kwargs = dict({'layers': 'bench', 'z': '7', 'x': '66', 'y': '45', 'format': '.png'}, **kwargs)
+        return lambda: check(view(factory.get('/tile/'), **kwargs))
+
+    def tile_miss():
+        classes['cached_view'].tile_cache.clear()
+        tile(cached_view)()
+
+    benchmarks = [
+        ('map_construction', lambda: classes['map'](request)),
+        ('symbolset', lambda: WmsSymbolSet().get_symbols()),
+        ('layer_dispatch', lambda: classes['layer'](request).dispatch_by_type()),
+    ]
+    for size in options.sizes:
+        benchmarks.append(('getmap_{0}'.format(size), getmap(size)))
+    benchmarks += [
+        ('tile_render', tile(view)),
+        ('tile_hit', tile(cached_view)),
+        ('tile_miss', tile_miss),
+        ('tile_empty', tile(empty_view)),
+        ('getcapabilities', lambda: check(capabilities_view(
+            factory.get('/wms/?SERVICE=WMS&REQUEST=GetCapabilities&VERSION=1.1.1')
+        ))),
+    ]
+
+    if options.only:
+        benchmarks = [(name, func) for name, func in benchmarks if name in options.only]
+    return benchmarks
+
+
+def measure(func, repeat):
+    """
+    Returns the minimum, median and mean time of the given function in
+    milliseconds. The function is called once before measuring, to fill
+    caches and build templates.
+    """
+    func()
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'mean': sum(times) / len(times)}
+
+
+def compare(results, baseline):
+    """
+    Prints the ratio to the baseline and returns the names of the
+    benchmarks that got slower than the tolerance.
+    """
+    slower = []
+    for name, result in results:
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        print('{0:<20} {1:6.2f}x baseline'.format(name, ratio))
+        if ratio > TOLERANCE:
+            slower.append(name)
+    return slower
+
+
+def run(options):
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        create_polygons(options.features)
+        results = []
+        for name, func in get_benchmarks(options):
+            results.append((name, measure(func, options.repeat)))
+            print('{0:<20} min {min:9.2f} ms median {median:9.2f} ms mean {mean:9.2f} ms'.format(name, **results[-1][1]))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    if options.save:
+        with open(options.save, 'w') as output:
+            json.dump(dict(results), output, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            slower = compare(results, json.load(baseline))
+        if slower:
+            print('Slower than baseline: {0}'.format(', '.join(slower)))
+            return 1
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks for the rendering hot paths of django-wms.')
+    parser.add_argument('--features', type=int, default=10000, help='Number of synthetic polygons.')
+    parser.add_argument('--classes', type=int, default=200, help='Number of cartography categories.')
+    parser.add_argument('--layers', type=int, default=100, help='Number of layers for GetCapabilities.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024, 2048], help='GetMap image sizes.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of measured iterations.')
+    parser.add_argument('--only', nargs='+', help='Names of the benchmarks to run.')
+    parser.add_argument('--save', help='Store the results as json in this file.')
+    parser.add_argument('--baseline', help='Compare the results to the json results in this file.')
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(run(get_parser().parse_args()))
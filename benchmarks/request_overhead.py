@@ -0,0 +1,56 @@
+"""
+Regression benchmark for the per request overhead of map construction.
+
+Builds a map with its symbol set for a large number of requests and reports
+the time per request and the resident memory for every batch. Both should
+stay flat, growing values point to state accumulating across requests.
+
+Run from the repository root with:
+
+    PYTHONPATH=. DJANGO_SETTINGS_MODULE=settings python benchmarks/request_overhead.py [requests] [batch]
+"""
+import resource
+import sys
+import time
+
+import django
+from django.test.client import RequestFactory
+from wms.maps import WmsMap
+
+# Allowed ratio between the last and the first batch
+TOLERANCE = 1.5
+
+
+def get_memory():
+    """
+    Returns the resident memory of this process in kilobytes.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(requests=100000, batch=10000):
+    django.setup()
+    request = RequestFactory().get('/wms/')
+    results = []
+    for start in range(0, requests, batch):
+        now = time.time()
+        for i in range(batch):
+            WmsMap(request)
+        elapsed = (time.time() - now) / batch
+        results.append((elapsed, get_memory()))
+        print('{0:>8} requests: {1:8.1f} us/request {2:>10} kB'.format(
+            start + batch, elapsed * 1e6, results[-1][1]))
+
+    first, last = results[0], results[-1]
+    if last[0] > first[0] * TOLERANCE or last[1] > first[1] * TOLERANCE:
+        print('Per request time or memory is not flat.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(*[int(arg) for arg in sys.argv[1:]]))
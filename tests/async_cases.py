@@ -0,0 +1,87 @@
+"""
+Tests for the async views, imported by test_asyncviews on Python 3 with
+Django 4.1 or later.
+"""
+import asyncio
+import threading
+
+from django.test import TestCase
+from django.test.client import AsyncRequestFactory
+from wms.asyncviews import AsyncRenderExecutor, AsyncWmsView
+from wms.cache import MemoryTileCache
+from wms.executors import RenderQueueFull, RenderTimeout
+
+from .test_polygon_view import MyMap
+
+
+class MyAsyncWms(AsyncWmsView):
+    map_class = MyMap
+
+
+class AsyncRenderExecutorTests(TestCase):
+
+    async def test_render(self):
+        executor = AsyncRenderExecutor(workers=2)
+        self.assertEqual(await executor.render(lambda x: x * 2, 21), 42)
+
+    async def test_queue_full(self):
+        executor = AsyncRenderExecutor(workers=1, max_queue=1)
+        release = threading.Event()
+        running = asyncio.ensure_future(executor.render(release.wait))
+        await asyncio.sleep(0.1)
+        with self.assertRaises(RenderQueueFull):
+            await executor.render(lambda: None)
+        release.set()
+        await running
+
+    async def test_timeout(self):
+        executor = AsyncRenderExecutor(workers=1, timeout=0.1)
+        release = threading.Event()
+        with self.assertRaises(RenderTimeout):
+            await executor.render(release.wait)
+        # The thread is still rendering and keeps its slot
+        self.assertEqual(executor._pending, 1)
+        release.set()
+        await asyncio.sleep(0.1)
+        self.assertEqual(executor._pending, 0)
+
+    async def test_cancelled_render_is_dropped(self):
+        executor = AsyncRenderExecutor(workers=1)
+        release = threading.Event()
+        calls = []
+        running = asyncio.ensure_future(executor.render(release.wait))
+        pending = asyncio.ensure_future(executor.render(calls.append, 'rendered'))
+        await asyncio.sleep(0.1)
+        # Cancelling stands in for a client disconnect
+        pending.cancel()
+        await asyncio.sleep(0.1)
+        release.set()
+        await running
+        await asyncio.sleep(0.1)
+        self.assertEqual(calls, [])
+        self.assertTrue(pending.cancelled())
+
+
+class AsyncWmsViewTests(TestCase):
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    async def test_empty_tile(self):
+        view = MyAsyncWms.as_view()
+        request = self.factory.get('/tile/testpolygon/9/141/216.png')
+        response = await view(request, layers='testpolygon', x='141', y='216', z='9', format='.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.has_header('ETag'))
+
+    async def test_cached_tile(self):
+        cache = MemoryTileCache()
+        view = MyAsyncWms.as_view(tile_cache=cache)
+        request = self.factory.get('/tile/testpolygon/9/141/216.png')
+        cache.set(MyAsyncWms(request=request, kwargs={
+            'layers': 'testpolygon', 'format': '.png',
+        }).get_tile_cache_key(141, 216, 9), b'tile')
+        response = await view(request, layers='testpolygon', x='141', y='216', z='9', format='.png')
+        self.assertEqual(response.content, b'tile')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 0})
@@ -3,3 +3,4 @@ from django.contrib.gis.db import models
 
 class TestPolygon(models.Model):
     geom = models.PolygonField()
+    modified = models.DateTimeField(auto_now=True)
@@ -0,0 +1,19 @@
+import sys
+from unittest import skipUnless
+
+import django
+from django.test import SimpleTestCase
+
+# The async views use syntax and APIs that older versions do not have
+ASYNC_VIEWS = sys.version_info >= (3, 5) and django.VERSION >= (4, 1)
+
+if ASYNC_VIEWS:
+    from .async_cases import AsyncRenderExecutorTests, AsyncWmsViewTests  # noqa: F401
+
+
+@skipUnless(ASYNC_VIEWS, 'Async views require Python 3 and Django 4.1 or later.')
+class AsyncViewsSupportTests(SimpleTestCase):
+
+    def test_import(self):
+        from wms.asyncviews import AsyncWmsView
+        self.assertTrue(AsyncWmsView.view_is_async)
@@ -0,0 +1,72 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms import capabilities, views
+from wms.cache import MemoryTileCache
+
+from .models import TestPolygon
+from .test_polygon_view import MyMap, VectorLayer
+
+CAPABILITIES_URL = '/wms/?SERVICE=WMS&REQUEST=GetCapabilities&VERSION=1.1.1'
+
+
+class MyCachedCapabilitiesWms(views.WmsView):
+    map_class = MyMap
+    capabilities_cache = MemoryTileCache()
+
+
+class CapabilitiesTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.view = MyCachedCapabilitiesWms.as_view()
+        MyCachedCapabilitiesWms.capabilities_cache.clear()
+        MyCachedCapabilitiesWms.capabilities_cache.reset_stats()
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+
+    def test_layer_extent(self):
+        layer = VectorLayer(self.factory.get(CAPABILITIES_URL))
+        self.assertEqual(layer.get_extent(), (10.0, 10.0, 40.0, 40.0))
+        TestPolygon.objects.create(geom='POLYGON ((0 0, 50 0, 50 5, 0 0))')
+        self.assertEqual(layer.get_extent(), (0.0, 0.0, 50.0, 40.0))
+
+    def test_layer_extent_follows_generation(self):
+        layer = VectorLayer(self.factory.get(CAPABILITIES_URL))
+        self.assertEqual(layer.get_extent(), (10.0, 10.0, 40.0, 40.0))
+
+        # Updates without signals are picked up once the generation changes,
+        # for instance when another process bumps it
+        TestPolygon.objects.update(geom='POLYGON ((0 0, 50 0, 50 5, 0 0))')
+        self.assertEqual(layer.get_extent(), (10.0, 10.0, 40.0, 40.0))
+        capabilities.bump_generation(TestPolygon)
+        self.assertEqual(layer.get_extent(), (0.0, 0.0, 50.0, 5.0))
+
+    def test_capabilities_are_cached(self):
+        first = self.view(self.factory.get(CAPABILITIES_URL))
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'testpolygon', first.content)
+        second = self.view(self.factory.get(CAPABILITIES_URL))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(MyCachedCapabilitiesWms.capabilities_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_service_exceptions_are_not_cached(self):
+        view = MyCachedCapabilitiesWms(request=self.factory.get(CAPABILITIES_URL), kwargs={})
+        exception = b'<?xml version="1.0"?><ServiceExceptionReport version="1.3.0"></ServiceExceptionReport>'
+        self.assertFalse(view.is_capabilities_document(exception, 'text/xml'))
+        self.assertFalse(view.is_capabilities_document(exception, 'application/vnd.ogc.se_xml'))
+        self.assertTrue(view.is_capabilities_document(b'<WMS_Capabilities version="1.3.0"/>', 'text/xml'))
+
+    def test_cache_key(self):
+        view = MyCachedCapabilitiesWms(request=self.factory.get(CAPABILITIES_URL), kwargs={})
+        key = view.get_capabilities_key({'REQUEST': 'GetCapabilities', 'VERSION': '1.1.1'})
+        self.assertNotEqual(key, view.get_capabilities_key({'REQUEST': 'GetCapabilities', 'VERSION': '1.3.0'}))
+        other = MyCachedCapabilitiesWms(request=self.factory.get(CAPABILITIES_URL, HTTP_HOST='example.com'), kwargs={})
+        self.assertNotEqual(key, other.get_capabilities_key({'REQUEST': 'GetCapabilities', 'VERSION': '1.1.1'}))
+
+    def test_data_change_refreshes_capabilities(self):
+        self.view(self.factory.get(CAPABILITIES_URL))
+        generation = capabilities.get_generation([TestPolygon])
+        TestPolygon.objects.create(geom='POLYGON ((0 0, 50 0, 50 5, 0 0))')
+        self.assertEqual(capabilities.get_generation([TestPolygon]), generation + 1)
+        self.view(self.factory.get(CAPABILITIES_URL))
+        self.assertEqual(MyCachedCapabilitiesWms.capabilities_cache.stats(), {'hits': 0, 'misses': 2})
@@ -1,3 +1,4 @@
+import sys
 from subprocess import PIPE, Popen
 
 from django.test import TestCase
@@ -9,7 +10,11 @@ class CodeSanityTests(TestCase):
         """
         Use flake8 for testing code quality
         """
-        result = Popen('flake8', stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        command = ['flake8']
+        if sys.version_info < (3,):
+            # The async views can only be parsed on Python 3
+            command.append('--exclude=build,.git,asyncviews.py,async_cases.py')
+        result = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
         output, err = result.communicate()
         self.assertTrue(result.returncode == 0, 'Flake8 Log not empty\n' + str(output))
 
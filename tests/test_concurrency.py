@@ -0,0 +1,42 @@
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from .test_polygon_view import MyWms
+
+GETMAP_URL = (
+    '/wms/?REQUEST=GetMap&LAYERS=testpolygon&FORMAT=image%2Fpng&HEIGHT={size}&WIDTH={size}'
+    '&SRS=EPSG%3A3086&BBOX=0,0,50,50&VERSION=1.1.1&styles=default'
+)
+
+
+class ConcurrentRenderingTests(TestCase):
+
+    def test_parallel_getmap_requests(self):
+        view = MyWms.as_view()
+        factory = RequestFactory()
+        results = []
+
+        def worker(size):
+            for i in range(10):
+                response = view(factory.get(GETMAP_URL.format(size=size)))
+                results.append((size, response))
+
+        # Each thread requests a different image size, so that responses
+        # mixed up between threads can be detected.
+        sizes = [64 + 16 * i for i in range(8)]
+        threads = [threading.Thread(target=worker, args=(size, )) for size in sizes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 80)
+        for size, response in results:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(Image.open(BytesIO(response.content)).size, (size, size))
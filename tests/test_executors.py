@@ -0,0 +1,75 @@
+import os
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms.executors import ProcessRenderExecutor
+
+from .test_polygon_view import MyMap, MyWms
+
+GETMAP_URL = (
+    '/wms/?REQUEST=GetMap&LAYERS=testpolygon&FORMAT=image%2Fpng&HEIGHT=400&WIDTH=400'
+    '&SRS=EPSG%3A3086&BBOX=0,0,50,50&VERSION=1.1.1&styles=default'
+)
+
+
+class MyPooledWms(MyWms):
+    map_class = MyMap
+    render_executor = ProcessRenderExecutor(processes=2, warm_views=['tests.test_polygon_view.MyWms'])
+
+
+class MySaturatedWms(MyWms):
+    map_class = MyMap
+    render_executor = ProcessRenderExecutor(processes=1, max_queue=0, retry_after=7)
+
+
+class MyFailingWms(MyWms):
+    map_class = MyMap
+    render_executor = ProcessRenderExecutor(processes=1, max_queue=1)
+
+    def render_ows(self, params):
+        raise ValueError('Broken map.')
+
+
+class MyCrashingWms(MyWms):
+    map_class = MyMap
+    render_executor = ProcessRenderExecutor(processes=1, max_queue=1, timeout=1, slot_timeout=1)
+
+    def render_ows(self, params):
+        os._exit(1)
+
+
+class RenderExecutorTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @classmethod
+    def tearDownClass(cls):
+        MyPooledWms.render_executor.close()
+        MySaturatedWms.render_executor.close()
+        MyFailingWms.render_executor.close()
+        MyCrashingWms.render_executor.close()
+        super(RenderExecutorTests, cls).tearDownClass()
+
+    def test_render_in_worker_process(self):
+        response = MyPooledWms.as_view()(self.factory.get(GETMAP_URL))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_saturated_executor(self):
+        response = MySaturatedWms.as_view()(self.factory.get(GETMAP_URL))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+    def test_failed_render(self):
+        # The queue slot is released after each failure
+        for i in range(2):
+            response = MyFailingWms.as_view()(self.factory.get(GETMAP_URL))
+            self.assertEqual(response.status_code, 502)
+
+    def test_crashed_worker(self):
+        # The slot of a job lost with its worker is reclaimed after the
+        # slot_timeout, instead of rejecting all further jobs
+        for i in range(2):
+            response = MyCrashingWms.as_view()(self.factory.get(GETMAP_URL))
+            self.assertEqual(response.status_code, 504)
@@ -0,0 +1,67 @@
+from django.conf.urls import url
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from wms import maps, views
+from wms.checks import check_layer_indexes
+from wms.indexes import LayerIndexReport, get_layer_classes, get_url_map_classes
+
+from .models import TestPolygon
+from .test_polygon_view import MyMap, VectorLayer
+
+
+class NestedVectorLayer(VectorLayer):
+    pass
+
+
+class NestedMap(MyMap):
+    pass
+
+
+class DeeplyNestedMap(NestedMap):
+    layer_classes = [NestedVectorLayer]
+
+
+class UrlMap(maps.WmsMap):
+    layer_classes = [VectorLayer]
+
+
+urlpatterns = [
+    url(r'^wms/$', views.WmsView.as_view(map_class=UrlMap)),
+]
+
+
+class LayerIndexTests(TestCase):
+
+    def setUp(self):
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+
+    def test_layer_classes(self):
+        self.assertIn(VectorLayer, get_layer_classes())
+        self.assertIn(NestedVectorLayer, get_layer_classes())
+
+    @override_settings(ROOT_URLCONF='tests.test_indexes')
+    def test_url_map_classes(self):
+        self.assertEqual(get_url_map_classes(), [UrlMap])
+
+    def test_spatial_index(self):
+        report = LayerIndexReport(VectorLayer)
+        self.assertEqual(report.get_missing_indexes(), [])
+        self.assertIn('tests_testpolygon', report.explain())
+
+    def test_command(self):
+        output = StringIO()
+        call_command('wms_check_indexes', 'tests.test_polygon_view', explain=True, stdout=output)
+        output = output.getvalue()
+        self.assertIn('VectorLayer (tests_testpolygon)', output)
+        self.assertIn('Indexes OK', output)
+        self.assertIn('Sample tile query plan:', output)
+
+    @override_settings(WMS_CHECK_INDEXES=True)
+    def test_system_check(self):
+        missing = [
+            warning for warning in check_layer_indexes(None)
+            if warning.obj is VectorLayer and warning.id == 'wms.W002'
+        ]
+        self.assertEqual(missing, [])
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+
+from django.test import TestCase
+from wms import views
+from wms.cache import FileSystemTileCache
+from wms.invalidation import TileInvalidator
+
+from .models import TestPolygon
+from .test_polygon_view import MyMap
+
+POLYGON = 'POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))'
+
+
+class TileInvalidatorTests(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+        class MyCachedWms(views.WmsView):
+            map_class = MyMap
+            tile_cache = FileSystemTileCache(self.location)
+
+        self.cache = MyCachedWms.tile_cache
+        self.invalidator = TileInvalidator(MyCachedWms, zooms=range(0, 3))
+        self.invalidator.connect()
+
+        # Tiles covering the polygon on zoom level 2, and one tile far away
+        self.keys = [
+            self.invalidator.get_key('', 'testpolygon', 2, x, y, '.png')
+            for x, y in [(2, 1), (0, 3)]
+        ]
+        for key in self.keys:
+            self.cache.set(key, b'tile')
+
+    def tearDown(self):
+        self.invalidator.disconnect()
+        shutil.rmtree(self.location)
+
+    def test_save_invalidates_covered_tiles(self):
+        with self.invalidator.batch():
+            TestPolygon.objects.create(geom=POLYGON)
+        self.assertIsNone(self.cache.get(self.keys[0]))
+        self.assertEqual(self.cache.get(self.keys[1]), b'tile')
+
+    def test_invalidate_extent(self):
+        with self.invalidator.batch():
+            self.invalidator.invalidate_extent((-170, -80, -160, -70), 4326)
+        self.assertEqual(self.cache.get(self.keys[0]), b'tile')
+        self.assertIsNone(self.cache.get(self.keys[1]))
+
+    def test_invalidate_polar_extent(self):
+        with self.invalidator.batch():
+            self.invalidator.invalidate_extent((-180, -90, 180, 90), 4326)
+        self.assertIsNone(self.cache.get(self.keys[0]))
+        self.assertIsNone(self.cache.get(self.keys[1]))
+
+    def test_layer_sets(self):
+        self.invalidator.layer_sets = ['testpolygon', 'testpolygon,other', 'other']
+        keys = [self.invalidator.get_key('', layers, 2, 2, 1, '.png') for layers in ['testpolygon,other', 'other']]
+        for key in keys:
+            self.cache.set(key, b'tile')
+        with self.invalidator.batch():
+            TestPolygon.objects.create(geom=POLYGON)
+        self.assertIsNone(self.cache.get(self.keys[0]))
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.assertEqual(self.cache.get(keys[1]), b'tile')
@@ -0,0 +1,81 @@
+from io import BytesIO
+
+from PIL import Image
+from raster.models import RasterTile
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms import views
+from wms.cache import MBTilesTileCache, MemoryTileCache
+from wms.metatiles import MetaTile
+from wms.tilegrid import tile_bounds
+
+from .models import TestPolygon
+from .test_polygon_view import MyMap
+from .test_raster_layer import MyRasterMap
+
+
+class MyMetaTileWms(views.WmsView):
+    map_class = MyMap
+    metatile_size = 2
+
+
+class MetaTileTests(TestCase):
+
+    def test_metatile_alignment(self):
+        metatile = MetaTile(141, 218, 9, 4, buffer=16)
+        self.assertEqual((metatile.x, metatile.y), (140, 216))
+        self.assertEqual(len(metatile.tiles()), 16)
+        self.assertEqual(metatile.get_size(), (1056, 1056))
+
+    def test_metatile_clipped_to_grid(self):
+        metatile = MetaTile(1, 0, 1, 4)
+        self.assertEqual(sorted(metatile.tiles()), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(metatile.get_bounds(), (
+            tile_bounds(0, 1, 1)[0], tile_bounds(0, 1, 1)[1],
+            tile_bounds(1, 0, 1)[2], tile_bounds(1, 0, 1)[3],
+        ))
+
+    def test_metatile_slice(self):
+        metatile = MetaTile(0, 0, 1, 2, buffer=8)
+        image = Image.new('RGBA', metatile.get_size(), (0, 0, 0, 0))
+        image.paste((255, 0, 0, 255), (8 + 256, 8, 8 + 512, 8 + 256))
+        output = BytesIO()
+        image.save(output, 'PNG')
+
+        tiles = metatile.slice(output.getvalue(), 'PNG')
+        self.assertEqual(len(tiles), 4)
+        tile = Image.open(BytesIO(tiles[(1, 0)]))
+        self.assertEqual(tile.size, (256, 256))
+        self.assertEqual(tile.getpixel((0, 0)), (255, 0, 0, 255))
+        self.assertEqual(Image.open(BytesIO(tiles[(0, 0)])).getpixel((255, 0)), (0, 0, 0, 0))
+
+
+class MetaTileViewTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+        RasterTile.objects.create(filename='testpolygon', tilex=0, tiley=0, tilez=1)
+        RasterTile.objects.create(filename='testpolygon', tilex=1, tiley=0, tilez=1)
+
+    def test_existing_siblings_are_stored(self):
+        cache = MemoryTileCache()
+        view = MyMetaTileWms.as_view(tile_cache=cache)
+        request = self.factory.get('/tile/testpolygon/1/0/0.png')
+        response = view(request, layers='testpolygon', x='0', y='0', z='1', format='.png')
+        self.assertEqual(response.status_code, 200)
+
+        keys = MyMetaTileWms(request=request, kwargs={'layers': 'testpolygon', 'format': '.png'})
+        self.assertIsNotNone(cache.peek(keys.get_tile_cache_key(0, 0, 1)))
+        self.assertIsNotNone(cache.peek(keys.get_tile_cache_key(1, 0, 1)))
+        self.assertIsNone(cache.peek(keys.get_tile_cache_key(0, 1, 1)))
+        self.assertIsNone(cache.peek(keys.get_tile_cache_key(1, 1, 1)))
+
+    def test_raster_maps_are_rendered_by_tile(self):
+        self.assertTrue(MyMetaTileWms().use_metatiles())
+        self.assertFalse(MyMetaTileWms(map_class=MyRasterMap).use_metatiles())
+
+    def test_read_only_cache_is_rendered_by_tile(self):
+        cache = MBTilesTileCache('missing.mbtiles')
+        self.assertFalse(MyMetaTileWms(tile_cache=cache).use_metatiles())
@@ -0,0 +1,111 @@
+import socket
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms import metrics, views
+
+from .models import TestPolygon
+from .test_polygon_view import WMS_URL, MyMap, MyWms
+
+
+class RecordingSink(metrics.BaseMetricsSink):
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, phase, duration, labels):
+        self.records.append((phase, labels))
+
+
+class MetricsTests(TestCase):
+
+    def test_timer_without_request_timer(self):
+        with metrics.timer('render'):
+            pass
+
+    def test_request_timer(self):
+        sink = RecordingSink()
+        with metrics.request_timer([sink], layer='testpolygon', zoom='9') as timing:
+            with metrics.timer('render'):
+                pass
+            with metrics.timer('layer_dispatch', layer='other'):
+                pass
+            with metrics.timer('render'):
+                pass
+        self.assertEqual(sink.records, [
+            ('render', {'layer': 'testpolygon', 'zoom': '9'}),
+            ('layer_dispatch', {'layer': 'other', 'zoom': '9'}),
+            ('render', {'layer': 'testpolygon', 'zoom': '9'}),
+        ])
+        self.assertEqual([part.split(';')[0] for part in timing.server_timing().split(', ')], ['render', 'layer_dispatch'])
+
+    def test_phase_timed_signal(self):
+        phases = []
+
+        def receiver(sender, phase, duration, labels, **kwargs):
+            phases.append(phase)
+
+        metrics.phase_timed.connect(receiver)
+        try:
+            with metrics.request_timer([]):
+                with metrics.timer('draw'):
+                    pass
+        finally:
+            metrics.phase_timed.disconnect(receiver)
+        self.assertEqual(phases, ['draw'])
+
+    def test_prometheus_sink(self):
+        sink = metrics.PrometheusSink(buckets=[0.1, 1.0])
+        sink.record('render', 0.5, {'layer': 'testpolygon', 'zoom': 9})
+        sink.record('render', 2.0, {'layer': 'testpolygon', 'zoom': 9})
+        text = sink.render()
+        labels = 'phase="render",layer="testpolygon",zoom="9"'
+        self.assertIn('# TYPE wms_phase_duration_seconds histogram', text)
+        self.assertIn('wms_phase_duration_seconds_bucket{' + labels + ',le="0.1"} 0', text)
+        self.assertIn('wms_phase_duration_seconds_bucket{' + labels + ',le="1.0"} 1', text)
+        self.assertIn('wms_phase_duration_seconds_bucket{' + labels + ',le="+Inf"} 2', text)
+        self.assertIn('wms_phase_duration_seconds_sum{' + labels + '} 2.5', text)
+        self.assertIn('wms_phase_duration_seconds_count{' + labels + '} 2', text)
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(1)
+        try:
+            sink = metrics.StatsdSink('127.0.0.1', server.getsockname()[1])
+            sink.record('render', 0.25, {'layer': 'test,polygon', 'zoom': '9'})
+            self.assertEqual(server.recv(1024), b'wms.test_polygon.z9.render:250.000|ms')
+        finally:
+            server.close()
+
+
+class MyTimedWms(views.WmsView):
+    map_class = MyMap
+    server_timing = True
+
+
+class TimedViewTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+
+    def test_server_timing_header(self):
+        sink = RecordingSink()
+        view = MyTimedWms.as_view(metrics_sinks=[sink])
+        response = view(self.factory.get(WMS_URL))
+        self.assertEqual(response.status_code, 200)
+        phases = [phase for phase, labels in sink.records]
+        for phase in ['map_construction', 'symbolset', 'layer_dispatch', 'draw', 'render', 'total']:
+            self.assertIn(phase, phases)
+            self.assertIn(phase + ';dur=', response['Server-Timing'])
+        self.assertEqual(sink.records[-1], ('total', {'layer': 'testpolygon', 'zoom': ''}))
+
+    def test_untimed_view(self):
+        response = MyWms.as_view()(self.factory.get(WMS_URL))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_unknown_layers_are_collapsed(self):
+        url = WMS_URL.replace('LAYERS=testpolygon', 'LAYERS=testpolygon,random1,random2')
+        view = MyTimedWms(request=self.factory.get(url), args=(), kwargs={})
+        self.assertEqual(view.get_metrics_labels(), {'layer': 'testpolygon,other', 'zoom': ''})
@@ -1,5 +1,9 @@
+from raster.models import RasterTile
+
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.utils import timezone
 from wms import layers, maps, views
 
 from .models import TestPolygon
@@ -24,6 +28,36 @@ class MyWms(views.WmsView):
     map_class = MyMap
 
 
+class VersionedVectorLayer(VectorLayer):
+    last_modified_field = 'modified'
+    cache_max_age = 600
+
+
+class MyVersionedMap(maps.WmsMap):
+    layer_classes = [VersionedVectorLayer]
+
+
+class MyVersionedWms(views.WmsView):
+    map_class = MyVersionedMap
+
+
+class MyNoContentWms(views.WmsView):
+    map_class = MyMap
+    empty_tile_mode = 'empty'
+
+
+class MyTemplateMap(maps.WmsMap):
+    layer_classes = [VectorLayer]
+    use_template = True
+
+
+class MyTemplateWms(views.WmsView):
+    map_class = MyTemplateMap
+
+
+WMS_URL = '/wms/?REQUEST=GetMap&LAYERS=testpolygon&FORMAT=image%2Fpng&HEIGHT=400&WIDTH=400&SRS=EPSG%3A3086&BBOX=0,0,50,50&VERSION=1.1.1&styles=default'
+
+
 class TestPolygonView(TestCase):
 
     def setUp(self):
@@ -40,3 +74,150 @@ class TestPolygonView(TestCase):
         request = self.factory.get('/tile/testpolygon/9/141/216.png')
         response = self.view(request)
         self.assertEqual(response.status_code, 200)
+
+    def test_template_map(self):
+        RasterTile.objects.create(filename='testpolygon', tilex=141, tiley=216, tilez=9)
+        tile = {'layers': 'testpolygon', 'x': '141', 'y': '216', 'z': '9', 'format': '.png'}
+        view = MyTemplateWms.as_view()
+        for i in range(2):
+            # The second requests render from a clone of the template
+            tile_response = view(self.factory.get('/tile/testpolygon/9/141/216.png'), **tile)
+            self.assertEqual(tile_response.status_code, 200)
+            wms_response = view(self.factory.get(WMS_URL))
+            self.assertEqual(wms_response.status_code, 200)
+        self.assertIn(MyTemplateMap, maps.WmsMap._templates)
+
+        # Cloned maps render the same output as freshly built maps
+        response = self.view(self.factory.get('/tile/testpolygon/9/141/216.png'), **tile)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(tile_response.content, response.content)
+        response = self.view(self.factory.get(WMS_URL))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(wms_response.content, response.content)
+
+    def test_deferred_connection(self):
+        class DeferredVectorLayer(VectorLayer):
+            defer_connection = True
+            dsn = 'host=localhost dbname=wms'
+
+        layer = DeferredVectorLayer(self.factory.get('/wms/')).dispatch_by_type()
+        self.assertEqual(layer.connection, 'host=localhost dbname=wms')
+        self.assertEqual(layer.getProcessing(0), 'CLOSE_CONNECTION=DEFER')
+
+    def test_empty_tile(self):
+        first = self.view(self.factory.get('/tile/testpolygon/9/141/216.png'), layers='testpolygon', x='141', y='216', z='9', format='.png')
+        second = self.view(self.factory.get('/tile/testpolygon/9/142/216.png'), layers='testpolygon', x='142', y='216', z='9', format='.png')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('max-age=31536000', first['Cache-Control'])
+
+    def test_empty_tile_no_content(self):
+        view = MyNoContentWms.as_view()
+        response = view(self.factory.get('/tile/testpolygon/9/141/216.png'), layers='testpolygon', x='141', y='216', z='9', format='.png')
+        self.assertEqual(response.status_code, 204)
+
+    def test_redirect_without_url(self):
+        view = MyWms.as_view(empty_tile_mode='redirect')
+        with self.assertRaises(ImproperlyConfigured):
+            view(self.factory.get('/tile/testpolygon/9/141/216.png'), layers='testpolygon', x='141', y='216', z='9', format='.png')
+
+    def test_conditional_request_with_data_version(self):
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+        view = MyVersionedWms.as_view()
+        response = view(self.factory.get(WMS_URL))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=600', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = view(self.factory.get(WMS_URL, HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('max-age=600', response['Cache-Control'])
+
+        # Changing the data changes the etag
+        etag = response['ETag']
+        TestPolygon.objects.first().save()
+        response = view(self.factory.get(WMS_URL, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+
+        # Deleting data that is not the latest change also changes the etag
+        etag = response['ETag']
+        TestPolygon.objects.order_by('modified').first().delete()
+        response = view(self.factory.get(WMS_URL, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+
+        # Naive dates are converted to aware dates for the headers
+        last_modified = VersionedVectorLayer(self.factory.get(WMS_URL)).get_last_modified()
+        self.assertTrue(timezone.is_aware(last_modified))
+
+    def test_service_exception_not_cached(self):
+        view = MyVersionedWms.as_view()
+        response = view(self.factory.get(WMS_URL.replace('EPSG%3A3086', 'EPSG%3A999999')))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Content-Type'], 'image/png')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_conditional_request_with_content_etag(self):
+        response = self.view(self.factory.get(WMS_URL))
+        self.assertEqual(response.status_code, 200)
+        response = self.view(self.factory.get(WMS_URL, HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+
+    def test_generalized_vector_data(self):
+        class GeneralizedVectorLayer(VectorLayer):
+            simplify_tolerance = 0.5
+            generalized_sources = [(5, 'tests_testpolygon_z5', None), (10, None, 'geom_simple')]
+            min_scale = 1000
+
+        request = self.factory.get('/tile/testpolygon/3/1/1.png')
+        data = GeneralizedVectorLayer(request, z='3').get_vector_data()
+        self.assertIn('ST_SimplifyPreserveTopology(geom, ', data)
+        self.assertIn('FROM tests_testpolygon_z5 WHERE geom && !BOX!)', data)
+        self.assertIn('USING UNIQUE id USING SRID=4326', data)
+
+        data = GeneralizedVectorLayer(request, z='8').get_vector_data()
+        self.assertIn('ST_SimplifyPreserveTopology(geom_simple, ', data)
+        self.assertIn('FROM tests_testpolygon WHERE geom_simple && !BOX!)', data)
+
+        # Zoom levels beyond the resolution table use the most detailed one
+        data = GeneralizedVectorLayer(request, z='35').get_vector_data()
+        self.assertIn('ST_SimplifyPreserveTopology(geom_simple, ', data)
+
+        layer = GeneralizedVectorLayer(self.factory.get(WMS_URL)).dispatch_by_type()
+        self.assertEqual(layer.minscaledenom, 1000)
+
+    def test_vector_data(self):
+        request = self.factory.get(WMS_URL)
+        self.assertEqual(
+            VectorLayer(request).get_vector_data(),
+            'geom FROM tests_testpolygon USING UNIQUE id USING SRID=4326'
+        )
+
+        class FilteredVectorLayer(VectorLayer):
+            where = 'id > 0'
+            filters = {'modified__isnull': False, 'id__in': [1, 2]}
+
+        data = FilteredVectorLayer(request).get_vector_data()
+        self.assertTrue(data.startswith(
+            'geom FROM (SELECT * FROM tests_testpolygon WHERE geom && !BOX! AND (id > 0) AND id IN (SELECT'
+        ))
+        self.assertIn('IN (1, 2)', data)
+        self.assertTrue(data.endswith(') AS wms_source USING UNIQUE id USING SRID=4326'))
+
+    def test_max_image_size(self):
+        view = MyWms.as_view(max_width=300, max_height=300)
+        response = view(self.factory.get(WMS_URL))
+        self.assertEqual(response.status_code, 400)
+        view = MyWms.as_view(max_width=400, max_height=400)
+        response = view(self.factory.get(WMS_URL))
+        self.assertEqual(response.status_code, 200)
+
+    def test_streaming_response(self):
+        data = self.view(self.factory.get(WMS_URL)).content
+        view = MyWms.as_view(stream_threshold=1, stream_chunk_size=100)
+        response = view(self.factory.get(WMS_URL))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertEqual(b''.join(response.streaming_content), data)
+        self.assertTrue(response.has_header('ETag'))
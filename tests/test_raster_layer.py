@@ -0,0 +1,130 @@
+import threading
+import time
+from ctypes import c_void_p
+
+from raster.models import RasterTile
+
+from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.gdal.libgdal import lgdal
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.encoding import force_bytes
+from wms import layers, maps, views
+
+
+def vsimem_exists(path):
+    """
+    Returns true if the in-memory GDAL file exists.
+    """
+    vsi_open = lgdal.VSIFOpenL
+    vsi_open.restype = c_void_p
+    handle = vsi_open(force_bytes(path), b'rb')
+    if handle:
+        lgdal.VSIFCloseL(c_void_p(handle))
+    return bool(handle)
+
+
+class MemoryRasterLayer(layers.WmsRasterLayer):
+    model = RasterTile
+    name = 'testraster'
+    where = "filename=\\'testraster\\'"
+    nodata = '0'
+    memory_source = True
+    cartography = [{'name': 'Category A', 'expression': '([pixel] = 1)', 'color': '#ff0000'}]
+
+
+class EvictingRasterLayer(MemoryRasterLayer):
+    raster_cache = layers.RasterMemoryCache(max_entries=1)
+
+
+class MyRasterMap(maps.WmsMap):
+    layer_classes = [MemoryRasterLayer]
+
+
+class MyRasterWms(views.WmsView):
+    map_class = MyRasterMap
+
+
+class MemoryRasterSourceTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        MemoryRasterLayer.raster_cache.clear()
+        MemoryRasterLayer.raster_cache.reset_stats()
+        self.tile = RasterTile.objects.create(
+            filename='testraster', tilex=0, tiley=0, tilez=0,
+            rast=GDALRaster({
+                'srid': 3857, 'width': 256, 'height': 256,
+                'origin': [-20037508.342789244, 20037508.342789244],
+                'scale': [156543.03392804097, -156543.03392804097],
+                'bands': [{'data': [1] * 256 * 256, 'nodata_value': 0}],
+            }),
+        )
+
+    def get_layer(self, x, y, z):
+        request = self.factory.get('/tile/testraster/{0}/{1}/{2}.png'.format(z, x, y))
+        return MemoryRasterLayer(request, x=str(x), y=str(y), z=str(z))
+
+    def test_memory_data(self):
+        path = self.get_layer(0, 0, 0).get_raster_data()
+        self.assertTrue(path.startswith('/vsimem/wms-'))
+        self.assertEqual(self.get_layer(0, 0, 0).get_raster_data(), path)
+        self.assertEqual(MemoryRasterLayer.raster_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_evicted_tiles_are_removed(self):
+        RasterTile.objects.create(filename='testraster', tilex=0, tiley=0, tilez=1, rast=self.tile.rast)
+        request = self.factory.get('/tile/testraster/0/0/0.png')
+        path = EvictingRasterLayer(request, x='0', y='0', z='0').get_raster_data()
+        self.assertTrue(vsimem_exists(path))
+
+        # Loading a second tile evicts the first one
+        request = self.factory.get('/tile/testraster/1/0/0.png')
+        other_path = EvictingRasterLayer(request, x='0', y='0', z='1').get_raster_data()
+        self.assertFalse(vsimem_exists(path))
+        self.assertTrue(vsimem_exists(other_path))
+
+        EvictingRasterLayer.raster_cache.clear()
+        self.assertFalse(vsimem_exists(other_path))
+
+    def test_concurrent_loads(self):
+        release = threading.Event()
+        layer = self.get_layer(0, 0, 0)
+        loads = MemoryRasterLayer.raster_cache.loads
+        coalesced = loads.coalesced
+        results = []
+
+        def load():
+            release.wait(5)
+            return layer.load_raster(0, 0, 0)
+
+        def get():
+            results.append(MemoryRasterLayer.raster_cache.get_or_load('tile', load))
+
+        threads = [threading.Thread(target=get) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        while loads.coalesced == coalesced:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # Both requests share the stored raster, which is not removed
+        self.assertIs(results[0], results[1])
+        self.assertIs(MemoryRasterLayer.raster_cache.peek('tile'), results[0])
+        self.assertTrue(vsimem_exists(results[0].name))
+
+    def test_missing_tile(self):
+        self.assertTrue(self.get_layer(1, 0, 1).get_raster_data().startswith('PG:'))
+
+    def test_data_change(self):
+        path = self.get_layer(0, 0, 0).get_raster_data()
+        self.tile.save()
+        self.assertNotEqual(self.get_layer(0, 0, 0).get_raster_data(), path)
+
+    def test_render_tile(self):
+        view = MyRasterWms.as_view()
+        request = self.factory.get('/tile/testraster/0/0/0.png')
+        response = view(request, layers='testraster', x='0', y='0', z='0', format='.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from raster.models import RasterTile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.six import StringIO
+from wms.cache import MBTilesTileCache
+
+from .test_polygon_view import MyWms
+
+
+class MyFailingWms(MyWms):
+
+    def render_ows(self, params):
+        raise ValueError('Broken map.')
+
+
+class SeedCommandTests(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        RasterTile.objects.create(filename='testpolygon', tilex=0, tiley=0, tilez=0)
+        RasterTile.objects.create(filename='testpolygon', tilex=1, tiley=0, tilez=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def seed(self, **kwargs):
+        output = StringIO()
+        kwargs.setdefault('location', self.location)
+        call_command(
+            'wms_seed', 'tests.test_polygon_view.MyMap', layers='testpolygon', zoom='0-1',
+            processes=1, stdout=output, **kwargs
+        )
+        return output.getvalue()
+
+    def get_tiles(self):
+        tiles = []
+        for root, dirs, files in os.walk(self.location):
+            tiles.extend(os.path.join(root, name) for name in files)
+        return sorted(tiles)
+
+    def test_seed(self):
+        output = self.seed()
+        tiles = self.get_tiles()
+        self.assertEqual(len(tiles), 2)
+        self.assertTrue(tiles[0].endswith(os.path.join('testpolygon', '0', '0', '0.png')))
+        self.assertTrue(tiles[1].endswith(os.path.join('testpolygon', '1', '1', '0.png')))
+        self.assertIn('5/5 tiles, 2 rendered, 3 empty, 0 skipped, 0 errors', output)
+
+    def test_seed_errors(self):
+        output = StringIO()
+        call_command(
+            'wms_seed', 'tests.test_seed.MyFailingWms', layers='testpolygon', zoom='0-1',
+            location=self.location, processes=1, stdout=output,
+        )
+        self.assertIn('5/5 tiles, 0 rendered, 3 empty, 0 skipped, 2 errors', output.getvalue())
+        self.assertIn('Errors of 2 of 2 failed tiles:', output.getvalue())
+        self.assertIn('0/0/0: ValueError: Broken map.', output.getvalue())
+
+    def test_seed_bbox(self):
+        output = self.seed(bbox='10,10,20,20')
+        self.assertIn('2/2 tiles, 2 rendered', output)
+
+    def test_seed_resume(self):
+        self.seed()
+        output = self.seed(resume=True)
+        self.assertIn('0 rendered, 3 empty, 2 skipped', output)
+
+    def test_seed_mbtiles(self):
+        path = os.path.join(self.location, 'tiles.mbtiles')
+        output = self.seed(location=None, mbtiles=path)
+        self.assertIn('5/5 tiles, 2 rendered, 3 empty', output)
+        connection = sqlite3.connect(path)
+        tiles = connection.execute('SELECT zoom_level, tile_column, tile_row FROM tiles ORDER BY zoom_level').fetchall()
+        self.assertEqual(tiles, [(0, 0, 0), (1, 1, 1)])
+        metadata = dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+        self.assertEqual(metadata['name'], 'testpolygon')
+        self.assertEqual(metadata['format'], 'png')
+        self.assertEqual((metadata['minzoom'], metadata['maxzoom']), ('0', '1'))
+        output = self.seed(location=None, mbtiles=path, resume=True)
+        self.assertIn('0 rendered, 3 empty, 2 skipped', output)
+
+    def test_serve_from_mbtiles(self):
+        path = os.path.join(self.location, 'tiles.mbtiles')
+        self.seed(location=None, mbtiles=path)
+        view = MyWms.as_view(tile_cache=MBTilesTileCache(path))
+        request = RequestFactory().get('/tile/testpolygon/1/1/0.png')
+        response = view(request, layers='testpolygon', x='1', y='0', z='1', format='.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, bytes(sqlite3.connect(path).execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = 1'
+        ).fetchone()[0]))
+        # Tiles missing from the package are rendered live
+        RasterTile.objects.create(filename='testpolygon', tilex=2, tiley=2, tilez=2)
+        response = view(request, layers='testpolygon', x='2', y='2', z='2', format='.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.test import TestCase
+from wms.singleflight import FileLockSingleFlight, SingleFlight
+
+
+class SingleFlightTests(TestCase):
+
+    def render(self):
+        time.sleep(0.2)
+        return b'image', 'image/png'
+
+    def run_concurrent(self, flight, count=10):
+        results = []
+
+        def worker():
+            results.append(flight.do('key', self.render))
+
+        threads = [threading.Thread(target=worker) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        results = self.run_concurrent(flight)
+        self.assertEqual(results, [(b'image', 'image/png')] * 10)
+        self.assertEqual(flight.stats(), {'calls': 1, 'coalesced': 9})
+
+    def test_errors_are_raised_in_all_calls(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('Render failed')
+
+        self.assertRaises(ValueError, flight.do, 'key', fail)
+        self.assertEqual(flight.do('key', self.render), (b'image', 'image/png'))
+
+    def test_file_lock_single_flight(self):
+        directory = tempfile.mkdtemp()
+        try:
+            flight = FileLockSingleFlight(directory)
+            # A second flight instance stands in for another process
+            other = FileLockSingleFlight(directory)
+            results = []
+
+            def worker(flight, delay):
+                time.sleep(delay)
+                results.append(flight.do('key', self.render))
+
+            threads = [threading.Thread(target=worker, args=(flight, 0)), threading.Thread(target=worker, args=(other, 0.1))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, [(b'image', 'image/png')] * 2)
+            self.assertEqual(flight.stats(), {'calls': 1, 'coalesced': 0})
+            self.assertEqual(other.stats(), {'calls': 0, 'coalesced': 1})
+
+            # Results are not kept once they were shared
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(other.do('key', self.render), (b'image', 'image/png'))
+            self.assertEqual(other.stats(), {'calls': 1, 'coalesced': 1})
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,19 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms import maps
+from wms.symbols import WmsSymbolSet
+
+
+class SymbolSetTests(TestCase):
+
+    def test_symbols_are_created_once(self):
+        symbols = WmsSymbolSet().get_symbols()
+        for i in range(10):
+            self.assertEqual(WmsSymbolSet().get_symbols(), symbols)
+        self.assertEqual(len(symbols), 6)
+
+    def test_map_symbolset_size_is_constant(self):
+        request = RequestFactory().get('/wms/')
+        for i in range(10):
+            wmsmap = maps.WmsMap(request)
+            self.assertEqual(wmsmap.map_object.symbolset.numsymbols, 7)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.core.cache import caches
+from django.test import TestCase
+from wms.cache import BaseTileCache, DjangoTileCache, FileSystemTileCache, MBTilesTileCache, tile_key
+
+
+class TileCacheTests(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.key = tile_key('mymap', 'testpolygon', 9, 141, 216, '.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_tile_key(self):
+        self.assertEqual(self.key, 'mymap/testpolygon/9/141/216.png')
+
+    def test_incomplete_cache(self):
+        class IncompleteTileCache(BaseTileCache):
+            def _get(self, key):
+                return None
+
+        self.assertRaises(TypeError, IncompleteTileCache)
+
+    def test_filesystem_cache(self):
+        cache = FileSystemTileCache(self.location)
+        self.assertIsNone(cache.get(self.key))
+        cache.set(self.key, b'tile')
+        self.assertEqual(cache.get(self.key), b'tile')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
+        cache.delete(self.key)
+        self.assertIsNone(cache.get(self.key))
+
+    def test_filesystem_cache_timeout(self):
+        cache = FileSystemTileCache(self.location, timeout=-1)
+        cache.set(self.key, b'tile')
+        self.assertIsNone(cache.get(self.key))
+
+    def test_filesystem_cache_max_size(self):
+        cache = FileSystemTileCache(self.location, max_size=10, cull_frequency=1)
+        for y in range(5):
+            cache.set(tile_key('mymap', 'testpolygon', 9, 141, y, '.png'), b'tile')
+        self.assertIsNone(cache.get(tile_key('mymap', 'testpolygon', 9, 141, 0, '.png')))
+        self.assertEqual(cache.get(tile_key('mymap', 'testpolygon', 9, 141, 4, '.png')), b'tile')
+
+    def test_django_cache(self):
+        cache = DjangoTileCache()
+        cache.set(self.key, b'tile')
+        self.assertEqual(cache.get(self.key), b'tile')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 0})
+
+        # Clearing the tiles leaves other cache entries alone
+        caches['default'].set('session', 'data')
+        cache.clear()
+        self.assertIsNone(cache.get(self.key))
+        self.assertEqual(caches['default'].get('session'), 'data')
+
+    def test_mbtiles_cache(self):
+        path = os.path.join(self.location, 'tiles.mbtiles')
+        package = MBTilesTileCache(path, readonly=False)
+        package.set(self.key, b'tile')
+        # Rows are stored in the TMS order
+        rows = sqlite3.connect(path).execute('SELECT zoom_level, tile_column, tile_row FROM tiles').fetchall()
+        self.assertEqual(rows, [(9, 141, 295)])
+        self.assertRaises(ValueError, package.set, tile_key('mymap', 'other', 9, 141, 216, '.png'), b'tile')
+
+        cache = MBTilesTileCache(path)
+        self.assertEqual(cache.get(self.key), b'tile')
+        self.assertIsNone(cache.get(tile_key('mymap', 'testpolygon', 9, 141, 216, '.jpg')))
+        self.assertIsNone(cache.get(tile_key('mymap', 'other', 9, 141, 216, '.png')))
+        # Read-only packages ignore writes
+        cache.set(tile_key('mymap', 'testpolygon', 9, 141, 217, '.png'), b'tile')
+        self.assertIsNone(cache.get(tile_key('mymap', 'testpolygon', 9, 141, 217, '.png')))
+
+    def test_mbtiles_cache_missing_package(self):
+        cache = MBTilesTileCache(os.path.join(self.location, 'missing.mbtiles'))
+        self.assertIsNone(cache.get(self.key))
+        self.assertFalse(os.path.exists(os.path.join(self.location, 'missing.mbtiles')))
@@ -0,0 +1,34 @@
+import numpy
+
+from django.test import TestCase
+from wms.layers import WmsBaseLayer
+from wms.tilegrid import GEOGRAPHIC_GRID, MERCATOR_GRID, tile_bounds, tile_range
+
+
+class TileGridTests(TestCase):
+
+    def test_mercator_grid_matches_tile_bounds(self):
+        x = numpy.array([0, 1, 141, 2 ** 20 - 1])
+        y = numpy.array([0, 0, 216, 2 ** 20 - 1])
+        z = numpy.array([0, 1, 9, 20])
+        bounds = numpy.array(MERCATOR_GRID.tile_bounds(x, y, z)).T
+        for i in range(len(x)):
+            self.assertTrue(numpy.allclose(bounds[i], tile_bounds(x[i], y[i], z[i])))
+            self.assertEqual(tile_range(*(tuple(bounds[i]) + (z[i], ))), (x[i], y[i], x[i], y[i]))
+
+        tile_minx, tile_miny, tile_maxx, tile_maxy = MERCATOR_GRID.tile_range(*(tuple(bounds.T) + (z, )))
+        self.assertEqual(list(tile_minx), list(x))
+        self.assertEqual(list(tile_maxy), list(y))
+
+    def test_resolutions(self):
+        self.assertAlmostEqual(MERCATOR_GRID.resolution(0), 156543.03, places=2)
+        self.assertAlmostEqual(MERCATOR_GRID.resolutions(30)[18], 0.5972, places=4)
+        self.assertAlmostEqual(WmsBaseLayer.ZOOM_METER_PER_PIXEL['25'], 0.004665, places=6)
+        self.assertAlmostEqual(MERCATOR_GRID.scale_denominator(0), 559082264.03, places=1)
+        self.assertEqual(list(MERCATOR_GRID.zoom_for_resolution([200000, 1.0])), [0, 18])
+
+    def test_geographic_grid(self):
+        self.assertEqual(GEOGRAPHIC_GRID.matrix_size(0), (2, 1))
+        self.assertEqual(tuple(GEOGRAPHIC_GRID.tile_bounds(1, 0, 0)), (0, -90, 180, 90))
+        x, y = GEOGRAPHIC_GRID.tiles(-10, -10, 10, 10, 1)
+        self.assertEqual(sorted(zip(x, y)), [(1, 0), (1, 1), (2, 0), (2, 1)])
@@ -0,0 +1,33 @@
+from raster.models import RasterTile
+
+from django.test import TestCase
+from wms.tileindex import RasterTileIndex
+
+
+class RasterTileIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = RasterTileIndex()
+        RasterTile.objects.create(filename='myraster.tif', tilex=141, tiley=216, tilez=9)
+
+    def test_tile_exists(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.index.exists(141, 216, 9, filename='myraster.tif'))
+            self.assertFalse(self.index.exists(141, 217, 9, filename='myraster.tif'))
+            self.assertFalse(self.index.exists(216, 141, 9, filename='myraster.tif'))
+            # Out of range indices would collide with the encoded index
+            self.assertFalse(self.index.exists(140, 216 + 512, 9, filename='myraster.tif'))
+            self.assertFalse(self.index.exists(142, -296, 9, filename='myraster.tif'))
+
+    def test_index_invalidated_on_save_and_delete(self):
+        self.assertFalse(self.index.exists(142, 216, 9, filename='myraster.tif'))
+        tile = RasterTile.objects.create(filename='myraster.tif', tilex=142, tiley=216, tilez=9)
+        self.assertTrue(self.index.exists(142, 216, 9, filename='myraster.tif'))
+        tile.delete()
+        self.assertFalse(self.index.exists(142, 216, 9, filename='myraster.tif'))
+
+    def test_other_filters_are_not_invalidated(self):
+        self.index.exists(141, 216, 9, filename='myraster.tif')
+        RasterTile.objects.create(filename='other.tif', tilex=1, tiley=1, tilez=9)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.index.exists(141, 216, 9, filename='myraster.tif'))
@@ -0,0 +1,83 @@
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from wms import layers, maps, views
+
+from .models import TestPolygon
+
+
+class CategoryVectorLayer(layers.WmsVectorLayer):
+    model = TestPolygon
+    cartography = [
+        {'name': 'Small', 'expression': '([id] < 10)', 'color': '58 112 38'},
+        {'name': 'Other', 'expression': '([id] >= 10 AND [id] < 20)', 'color': '#ff0000'},
+    ]
+
+
+class MyVectorTileMap(maps.WmsMap):
+    layer_classes = [CategoryVectorLayer]
+
+
+class MyVectorTileWms(views.WmsView):
+    map_class = MyVectorTileMap
+
+
+class MyStyleView(views.WmsStyleView):
+    map_class = MyVectorTileMap
+
+
+class VectorTileTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TestPolygon.objects.create(geom='POLYGON ((30 10, 40 40, 20 40, 10 20, 30 10))')
+
+    def get_tile(self, x, y, z):
+        request = self.factory.get('/tile/testpolygon/{0}/{1}/{2}.pbf'.format(z, x, y))
+        return MyVectorTileWms.as_view()(request, layers='testpolygon', x=str(x), y=str(y), z=str(z), format='.pbf')
+
+    def test_expression_filter(self):
+        self.assertEqual(layers.expression_filter('([id] < 10)'), ['<', ['get', 'id'], 10])
+        self.assertEqual(layers.expression_filter('("[name]" = "park")'), ['==', ['get', 'name'], 'park'])
+        self.assertIsNone(layers.expression_filter('([id] >= 10 AND [id] < 20)'))
+
+    def test_mvt_fields(self):
+        layer = CategoryVectorLayer(self.factory.get('/'))
+        self.assertEqual(layer.get_mvt_fields(), ['id'])
+        layer.mvt_fields = ['modified', 'missing']
+        self.assertEqual(layer.get_mvt_fields(), ['id', 'modified'])
+
+    def test_vector_tile(self):
+        response = self.get_tile(2, 1, 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], views.VECTOR_TILE_FORMAT)
+        self.assertIn(b'testpolygon', response.content)
+
+    def test_empty_vector_tile(self):
+        response = self.get_tile(0, 0, 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+
+    def test_style(self):
+        response = MyStyleView.as_view()(self.factory.get('/style.json'))
+        style = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(style['sources']['wms']['tiles'], ['http://testserver/tile/testpolygon/{z}/{x}/{y}.pbf'])
+        self.assertEqual([layer['id'] for layer in style['layers']], ['testpolygon-0', 'testpolygon-1'])
+        self.assertEqual(style['layers'][0]['type'], 'fill')
+        self.assertEqual(style['layers'][0]['paint']['fill-color'], '#3a7026')
+        self.assertEqual(style['layers'][0]['filter'], ['<', ['get', 'id'], 10])
+        self.assertEqual(style['layers'][1]['metadata']['expression'], '([id] >= 10 AND [id] < 20)')
+
+    def test_style_view_with_initkwargs(self):
+        view = views.WmsStyleView.as_view(map_class=MyVectorTileMap, tile_url='/tiles/{layers}/{z}/{x}/{y}.pbf')
+        style = json.loads(view(self.factory.get('/style.json')).content.decode('utf-8'))
+        self.assertEqual(style['sources']['wms']['tiles'], ['http://testserver/tiles/testpolygon/{z}/{x}/{y}.pbf'])
+
+    def test_view_with_initkwargs(self):
+        view = views.WmsView.as_view(map_class=MyVectorTileMap)
+        request = self.factory.get('/tile/testpolygon/2/2/1.pbf')
+        response = view(request, layers='testpolygon', x='2', y='1', z='2', format='.pbf')
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(TypeError):
+            views.WmsView.as_view()(request)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class WmsConfig(AppConfig):
+    name = 'wms'
+    verbose_name = 'Django WMS'
+
+    def ready(self):
+        # Register system checks
+        from wms import checks  # noqa
@@ -0,0 +1,223 @@
+"""
+Asynchronous variant of the WmsView for ASGI deployments. This module
+requires Python 3 and Django 4.1 or later, it can not be imported on older
+versions.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from raster.models import RasterTile
+
+from django.db import close_old_connections
+from django.http import HttpResponse
+from wms.cache import MemoryTileCache
+from wms.executors import RenderError, RenderQueueFull, RenderTimeout
+from wms.views import VECTOR_TILE_FORMAT, WmsView
+
+
+class AsyncRenderExecutor(object):
+    """
+    Runs blocking render functions in a bounded pool of threads. At most
+    max_queue renders are accepted at the same time, including the ones that
+    are running, further renders are rejected with RenderQueueFull. Renders
+    that take longer than timeout seconds raise RenderTimeout.
+
+    Renders that are cancelled before a thread picks them up, for instance
+    because the client disconnected, are dropped without rendering.
+    """
+    workers = 4
+    max_queue = 64
+    timeout = 30
+    retry_after = 5
+
+    def __init__(self, workers=None, max_queue=None, timeout=None, retry_after=None):
+        if workers is not None:
+            self.workers = workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if timeout is not None:
+            self.timeout = timeout
+        if retry_after is not None:
+            self.retry_after = retry_after
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def get_executor(self):
+        """
+        Returns the thread pool, starting it on first use in the current
+        process.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers)
+                self._pid = os.getpid()
+                self._pending = 0
+            return self._executor
+
+    async def render(self, func, *args):
+        """
+        Runs the render function in the thread pool and returns its result.
+        """
+        executor = self.get_executor()
+        with self._lock:
+            if self._pending >= self.max_queue:
+                raise RenderQueueFull('Render queue is full.')
+            self._pending += 1
+
+        # The slot is released when the thread is done, renders that timed
+        # out keep their slot until they actually finish.
+        try:
+            job = executor.submit(self.run, func, *args)
+        except Exception:
+            self.release()
+            raise
+        job.add_done_callback(self.release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout('Rendering took longer than {0} seconds.'.format(self.timeout))
+
+    def release(self, job=None):
+        """
+        Frees the slot of a finished or cancelled render.
+        """
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, func, *args):
+        """
+        Calls the render function and releases database connections that
+        are no longer usable afterwards.
+        """
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    def close(self):
+        """
+        Stops the threads after all pending renders are done.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# Executor shared by all async views that do not specify their own
+default_executor = AsyncRenderExecutor()
+
+
+class AsyncWmsView(WmsView):
+    """
+    WMS view for ASGI servers. Cache lookups and tile existence checks run
+    without blocking the event loop, rendering runs in the threads of the
+    async_executor. If the client disconnects while a render is waiting for
+    a thread, the render is dropped.
+
+    Request timing through metrics sinks is not supported by this view.
+    """
+
+    http_method_names = ['get']
+    async_executor = default_executor
+
+    async def dispatch(self, request, *args, **kwargs):
+        """
+        Returns 503 responses if the executor is saturated, 504 responses
+        if rendering timed out and 502 responses if rendering failed in a
+        worker process.
+        """
+        try:
+            return await super(WmsView, self).dispatch(request, *args, **kwargs)
+        except RenderQueueFull:
+            return self.get_queue_full_response(self.async_executor.retry_after)
+        except RenderTimeout:
+            return self.get_timeout_response()
+        except RenderError:
+            return self.get_render_error_response()
+
+    async def get(self, request, *args, **kwargs):
+        tileparams, format, params = self.get_request_params()
+
+        # Reject oversized images before rendering
+        if not tileparams and self.is_too_large(params):
+            return self.get_too_large_response()
+
+        # Answer conditional requests before rendering
+        layers = self.get_requested_layers(params)
+        version = await sync_to_async(self.get_data_version)(layers)
+        last_modified = version and version[0]
+        etag = self.get_etag(params, version)
+        if self.is_not_modified(etag, last_modified):
+            return self.get_not_modified_response(etag, last_modified, self.get_cache_max_age(layers))
+
+        if tileparams:
+            response = await self.get_tile_response_async(format, params, *tileparams)
+            return self.finalize_response(response, format, etag, last_modified, layers)
+
+        data, contenttype = await self.async_executor.render(self.render, params)
+        response = self.get_render_response(data, contenttype)
+
+        return self.finalize_response(response, self.get_requested_format(params), etag, last_modified, layers, data)
+
+    async def get_tile_response_async(self, format, params, x, y, z):
+        """
+        Returns the response for a tile, served from the tile cache if
+        possible.
+        """
+        store = self.get_tile_store()
+        if store:
+            cache_key = self.get_tile_cache_key(x, y, z)
+            data = await self.cache_get(store, cache_key)
+            if data is not None:
+                return HttpResponse(data, content_type=format)
+
+        if format == VECTOR_TILE_FORMAT:
+            data = await self.async_executor.render(self.render_vector_tile, params, x, y, z)
+            contenttype = format
+        elif not await self.tile_exists_async(x, y, z):
+            return self.get_empty_tile_response(format)
+        elif self.use_metatiles():
+            # Metatiles store their tiles themselves
+            data, contenttype = await self.async_executor.render(self.render_metatile, format, x, y, z)
+            return HttpResponse(data, content_type=contenttype)
+        else:
+            data, contenttype = await self.async_executor.render(self.render, params)
+
+        # Store rendered tile in cache, error documents are not cached
+        if store and contenttype == format:
+            await sync_to_async(store.set, thread_sensitive=False)(cache_key, data)
+
+        return HttpResponse(data, content_type=contenttype)
+
+    async def cache_get(self, store, key):
+        """
+        Returns a tile from the tile store. Memory caches are read directly,
+        other stores in a thread.
+        """
+        if isinstance(store, MemoryTileCache):
+            return store.get(key)
+        return await sync_to_async(store.get, thread_sensitive=False)(key)
+
+    async def tile_exists_async(self, x, y, z):
+        """
+        Returns true if the requested XYZ tile exists. Loaded tile indexes
+        are checked directly, otherwise the database is queried without
+        blocking the event loop. Overrides of tile_exists run in a thread.
+        """
+        if self.__class__.tile_exists is not WmsView.tile_exists:
+            return await sync_to_async(self.tile_exists)(x, y, z)
+
+        filename = self.kwargs.get('layers', '')
+        if self.tile_index:
+            if self.tile_index.is_loaded(z, filename=filename):
+                return self.tile_index.exists(x, y, z, filename=filename)
+            return await sync_to_async(self.tile_index.exists)(x, y, z, filename=filename)
+
+        return await RasterTile.objects.filter(tilex=x, tiley=y, tilez=z, filename=filename).aexists()
@@ -0,0 +1,506 @@
+import abc
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.utils.http import urlencode
+
+
+def tile_namespace(map_class, params):
+    """
+    Returns the namespace of the tiles rendered by the given map class with
+    the given query parameters, which are given as a list of (name, values)
+    pairs. The namespace is a string made of the map class name and a hash
+    of the map path and parameters.
+    """
+    map_path = '{0}.{1}'.format(map_class.__module__, map_class.__name__)
+    params = urlencode(sorted(params), doseq=True)
+    digest = hashlib.sha1((map_path + '?' + params).encode('utf-8')).hexdigest()[:12]
+    return '{0}-{1}'.format(map_class.__name__.lower(), digest)
+
+
+def tile_key(namespace, layers, z, x, y, extension):
+    """
+    Returns the cache key for a single XYZ tile. The key is a relative path
+    of the form namespace/layers/z/x/y.ext, so it can be used directly as
+    a location in a z/x/y directory tree.
+    """
+    layers = layers.replace(os.sep, '_').replace('..', '_')
+    return '/'.join([namespace, layers, str(z), str(x), str(y) + extension])
+
+
+# Base for abstract classes on both Python 2 and 3
+_ABC = abc.ABCMeta('_ABC', (object, ), {})
+
+
+class BaseTileCache(_ABC):
+    """
+    Base class for rendered tile caches. Subclasses implement the storage
+    specific _get, _set, _delete and _clear methods, this class keeps track
+    of hit and miss counts for the current process.
+
+    The timeout is the time to live of a tile in seconds, None means tiles
+    never expire.
+    """
+    timeout = None
+
+    def __init__(self, timeout=None):
+        if timeout is not None:
+            self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the tile data for the given key or None if the tile is not
+        in the cache.
+        """
+        data = self._get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def peek(self, key):
+        """
+        Returns the tile data for the given key without updating the hit
+        and miss counters.
+        """
+        return self._get(key)
+
+    def set(self, key, data):
+        """
+        Stores tile data under the given key.
+        """
+        self._set(key, data)
+
+    def delete(self, key):
+        """
+        Removes a tile from the cache.
+        """
+        self._delete(key)
+
+    def clear(self):
+        """
+        Removes all tiles from the cache.
+        """
+        self._clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the hit and miss counts for this process.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        """
+        Resets the hit and miss counters.
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    @abc.abstractmethod
+    def _get(self, key):
+        """
+        Returns the stored tile data or None.
+        """
+
+    @abc.abstractmethod
+    def _set(self, key, data):
+        """
+        Stores the tile data.
+        """
+
+    @abc.abstractmethod
+    def _delete(self, key):
+        """
+        Removes a stored tile.
+        """
+
+    @abc.abstractmethod
+    def _clear(self):
+        """
+        Removes all stored tiles.
+        """
+
+
+class MemoryTileCache(BaseTileCache):
+    """
+    Tile cache keeping tiles in the memory of the current process. Once the
+    cache holds max_entries tiles, the least recently used tiles are removed.
+    """
+    max_entries = 1000
+
+    def __init__(self, timeout=None, max_entries=None):
+        super(MemoryTileCache, self).__init__(timeout=timeout)
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._tiles = OrderedDict()
+
+    def removed(self, key, data):
+        """
+        Called for every tile that leaves the cache, because it was evicted,
+        expired, replaced or deleted. Does nothing by default.
+        """
+        pass
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                created, data = self._tiles.pop(key)
+            except KeyError:
+                return None
+            if self.timeout is None or time.time() - created <= self.timeout:
+                # Move tile to the end of the queue
+                self._tiles[key] = (created, data)
+                return data
+        self.removed(key, data)
+        return None
+
+    def _set(self, key, data):
+        removed = []
+        with self._lock:
+            if key in self._tiles:
+                removed.append((key, self._tiles.pop(key)[1]))
+            self._tiles[key] = (time.time(), data)
+            while len(self._tiles) > self.max_entries:
+                old_key, (created, old_data) = self._tiles.popitem(last=False)
+                removed.append((old_key, old_data))
+        for old_key, old_data in removed:
+            if old_data is not data:
+                self.removed(old_key, old_data)
+
+    def _delete(self, key):
+        with self._lock:
+            tile = self._tiles.pop(key, None)
+        if tile is not None:
+            self.removed(key, tile[1])
+
+    def _clear(self):
+        with self._lock:
+            tiles = list(self._tiles.items())
+            self._tiles.clear()
+        for key, (created, data) in tiles:
+            self.removed(key, data)
+
+
+class FileSystemTileCache(BaseTileCache):
+    """
+    Tile cache storing tiles as files in a z/x/y directory tree below the
+    given location.
+
+    Tiles older than the timeout are treated as missing and removed on
+    read. If max_size (in bytes) is set, the oldest tiles are removed once
+    the tree grows beyond that size. The size is checked every
+    cull_frequency writes, so the tree can temporarily exceed max_size.
+    """
+    max_size = None
+    cull_frequency = 100
+
+    def __init__(self, location, timeout=None, max_size=None, cull_frequency=None):
+        super(FileSystemTileCache, self).__init__(timeout=timeout)
+        self.location = location
+        if max_size is not None:
+            self.max_size = max_size
+        if cull_frequency is not None:
+            self.cull_frequency = cull_frequency
+        self._writes = 0
+
+    def get_path(self, key):
+        """
+        Returns the absolute file path for a tile key.
+        """
+        return os.path.join(self.location, *key.split('/'))
+
+    def _get(self, key):
+        path = self.get_path(key)
+        try:
+            if self.timeout is not None and time.time() - os.path.getmtime(path) > self.timeout:
+                self._delete(key)
+                return None
+            with open(path, 'rb') as tile:
+                return tile.read()
+        except (IOError, OSError):
+            return None
+
+    def _set(self, key, data):
+        path = self.get_path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        # Write to a temporary file first and move it in place, so that
+        # concurrent readers never see partially written tiles.
+        handle, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as tile:
+                tile.write(data)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if self.max_size is not None:
+            with self._lock:
+                self._writes += 1
+                cull = self._writes % self.cull_frequency == 0
+            if cull:
+                self.cull()
+
+    def _delete(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+
+    def _clear(self):
+        for root, dirs, files in os.walk(self.location, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+
+    def cull(self):
+        """
+        Removes the least recently written tiles until the total size of
+        the cache is below max_size.
+        """
+        tiles = []
+        total = 0
+        for root, dirs, files in os.walk(self.location):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        for mtime, size, path in sorted(tiles):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+class DjangoTileCache(BaseTileCache):
+    """
+    Tile cache storing tiles in one of the caches configured in the CACHES
+    setting. Size based eviction is left to the cache backend, for instance
+    through the MAX_ENTRIES option or the memcached memory limit.
+
+    The keys include a generation that is stored in the cache as well.
+    Clearing the tile cache bumps the generation instead of clearing the
+    whole cache, the old tiles are left to expire or be evicted.
+    """
+    key_prefix = 'wms-tile'
+
+    def __init__(self, alias='default', timeout=None):
+        super(DjangoTileCache, self).__init__(timeout=timeout)
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        """
+        Hashes the tile key, keeping cache keys short and free of characters
+        that memcached does not accept.
+        """
+        return '{0}:{1}:{2}'.format(
+            self.key_prefix, self.get_generation(), hashlib.sha1(key.encode('utf-8')).hexdigest()
+        )
+
+    def get_generation_key(self):
+        """
+        Returns the cache key of the tile generation.
+        """
+        return '{0}:generation'.format(self.key_prefix)
+
+    def get_generation(self):
+        """
+        Returns the current generation of the tiles. Generations start at the
+        current time in milliseconds, so that old tiles are not served again
+        if the cache loses the generation.
+        """
+        key = self.get_generation_key()
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, int(time.time() * 1000), None)
+            generation = self.cache.get(key, 0)
+        return generation
+
+    def _get(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def _set(self, key, data):
+        self.cache.set(self.make_key(key), data, self.timeout)
+
+    def _delete(self, key):
+        self.cache.delete(self.make_key(key))
+
+    def _clear(self):
+        try:
+            self.cache.incr(self.get_generation_key())
+        except ValueError:
+            self.cache.add(self.get_generation_key(), int(time.time() * 1000), None)
+
+
+class MBTilesTileCache(BaseTileCache):
+    """
+    Tile cache backed by an MBTiles package, a SQLite database holding the
+    tiles of a single tileset. The tileset is identified by the namespace,
+    layers and format of the first tile written to the package, lookups for
+    other tilesets are misses.
+
+    Packages are opened read-only by default, each process and thread opens
+    its own memory mapped connection. Writes, deletes and clears are ignored
+    in read-only mode, so that views fall back to live rendering for tiles
+    that are missing from the package. Tiles in a package never expire.
+    """
+    mmap_size = 256 * 1024 * 1024
+
+    def __init__(self, path, readonly=True, mmap_size=None):
+        super(MBTilesTileCache, self).__init__()
+        self.path = path
+        self.readonly = readonly
+        if mmap_size is not None:
+            self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    def get_connection(self):
+        """
+        Returns the connection of the current process and thread, or None if
+        a read-only package does not exist.
+        """
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.connection = None
+            self._local.tileset = None
+
+        if self._local.connection is None:
+            if self.readonly and not os.path.exists(self.path):
+                return None
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA mmap_size = {0:d}'.format(self.mmap_size))
+            if self.readonly:
+                connection.execute('PRAGMA query_only = ON')
+            else:
+                connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS tiles '
+                    '(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)'
+                )
+                connection.execute(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)'
+                )
+                connection.commit()
+            self._local.connection = connection
+
+        return self._local.connection
+
+    def get_tileset(self, connection):
+        """
+        Returns the tileset and format of the package, or None if the
+        package is empty.
+        """
+        if self._local.tileset is None:
+            metadata = dict(connection.execute(
+                "SELECT name, value FROM metadata WHERE name IN ('wms_tileset', 'format')"
+            ).fetchall())
+            if 'wms_tileset' not in metadata:
+                return None
+            self._local.tileset = (metadata['wms_tileset'], '.' + metadata.get('format', 'png'))
+        return self._local.tileset
+
+    def parse_key(self, key):
+        """
+        Returns the tileset, format and the z, x and y indices in the
+        MBTiles row order of a tile key.
+        """
+        tileset, z, x, name = key.rsplit('/', 3)
+        y, extension = os.path.splitext(name)
+        z, x, y = int(z), int(x), int(y)
+        return tileset, extension, z, x, 2 ** z - 1 - y
+
+    def set_metadata(self, **values):
+        """
+        Writes entries of the metadata table, such as bounds, minzoom and
+        maxzoom.
+        """
+        connection = self.get_connection()
+        connection.executemany(
+            'INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)',
+            [(name, str(value)) for name, value in values.items()],
+        )
+        connection.commit()
+
+    def _get(self, key):
+        connection = self.get_connection()
+        if connection is None:
+            return None
+        tileset, extension, z, x, row = self.parse_key(key)
+        if self.get_tileset(connection) != (tileset, extension):
+            return None
+        result = connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', (z, x, row)
+        ).fetchone()
+        return bytes(result[0]) if result else None
+
+    def _set(self, key, data):
+        if self.readonly:
+            return
+        connection = self.get_connection()
+        tileset, extension, z, x, row = self.parse_key(key)
+        current = self.get_tileset(connection)
+        if current is None:
+            self.set_metadata(
+                wms_tileset=tileset, name=tileset.rsplit('/', 1)[-1], format=extension[1:],
+                type='baselayer', version='1.0',
+            )
+        elif current != (tileset, extension):
+            raise ValueError('The package {0} holds the tileset {1}{2}.'.format(self.path, *current))
+        connection.execute(
+            'INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+            (z, x, row, sqlite3.Binary(data)),
+        )
+        connection.commit()
+
+    def _delete(self, key):
+        if self.readonly:
+            return
+        tileset, extension, z, x, row = self.parse_key(key)
+        connection = self.get_connection()
+        connection.execute(
+            'DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', (z, x, row)
+        )
+        connection.commit()
+
+    def _clear(self):
+        if self.readonly:
+            return
+        connection = self.get_connection()
+        connection.execute('DELETE FROM tiles')
+        connection.commit()
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.db.models import Extent, GeometryField, RasterField
+from django.core.cache import caches
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+# Extents of the layer data with the time they were queried, keyed by
+# model, field name, database and data generation
+_extents = {}
+
+# Latest changes of the layer data with the time they were queried, keyed by
+# model, field name, database and data generation
+_last_modified = {}
+
+# Whether models have a spatial field and can back a layer
+_spatial_models = {}
+
+_lock = threading.Lock()
+
+
+def get_extent(model, field_name, using='default', timeout=300):
+    """
+    Returns the extent of a spatial field as (xmin, ymin, xmax, ymax) in the
+    srid of the field, or None if the table is empty. The extent is queried
+    once per data generation and kept for at most timeout seconds, to pick
+    up changes that do not send model signals.
+    """
+    def query():
+        return model.objects.using(using).aggregate(extent=Extent(field_name))['extent']
+    return _get_cached(_extents, (model, field_name, using), model, timeout, query)
+
+
+def get_last_modified(model, field_name, using='default', timeout=5):
+    """
+    Returns the latest value of a date field, made aware in the default time
+    zone if it is naive. The value is queried once per data generation and
+    kept for at most timeout seconds, to pick up changes that do not send
+    model signals.
+    """
+    def query():
+        last_modified = model.objects.using(using).aggregate(last_modified=Max(field_name))['last_modified']
+        if last_modified is not None and timezone.is_naive(last_modified):
+            last_modified = timezone.make_aware(last_modified, timezone.get_default_timezone())
+        return last_modified
+    return _get_cached(_last_modified, (model, field_name, using), model, timeout, query)
+
+
+def _get_cached(values, key, model, timeout, query):
+    """
+    Returns the value stored under the key and the current data generation
+    of the model, or stores the result of the query if there is none or it
+    is older than timeout seconds. Values of older generations are dropped.
+    """
+    generation = get_generation([model])
+    cached = values.get(key + (generation, ))
+    if cached is not None and time.time() - cached[0] <= timeout:
+        return cached[1]
+
+    value = query()
+    with _lock:
+        for old in [old for old in values if old[:-1] == key]:
+            del values[old]
+        values[key + (generation, )] = (time.time(), value)
+    return value
+
+
+def get_version_cache():
+    """
+    Returns the Django cache that holds the data generations, set through
+    the WMS_VERSION_CACHE setting.
+    """
+    return caches[getattr(settings, 'WMS_VERSION_CACHE', 'default')]
+
+
+def get_version_key(model):
+    """
+    Returns the cache key of the data generation of a model.
+    """
+    return 'wms-generation:{0}'.format(model._meta.label_lower)
+
+
+def get_generation(models):
+    """
+    Returns a number that increases whenever the data of one of the given
+    models changes. The generations are kept in the WMS_VERSION_CACHE, with
+    a cache that is shared between processes the changes of all processes
+    are seen. Generations start at the current time in milliseconds, so
+    that they do not repeat when the cache loses them.
+    """
+    cache = get_version_cache()
+    keys = [get_version_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time() * 1000), None)
+            generations[key] = cache.get(key, 0)
+    return sum(generations.values())
+
+
+def bump_generation(model):
+    """
+    Increases the data generation of a model. This happens automatically
+    when instances of models with spatial fields are saved or deleted, call
+    it after changes that do not send model signals, such as bulk updates.
+    """
+    cache = get_version_cache()
+    key = get_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+
+def is_spatial_model(model):
+    """
+    Returns true if the model has a geometry or raster field.
+    """
+    if model not in _spatial_models:
+        _spatial_models[model] = any(
+            isinstance(field, (GeometryField, RasterField)) for field in model._meta.fields
+        )
+    return _spatial_models[model]
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_extents(sender, **kwargs):
+    """
+    Bumps the data generation of a changed spatial model.
+    """
+    if is_spatial_model(sender):
+        bump_generation(sender)
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+from django.db import DatabaseError
+from wms.indexes import LayerIndexReport, get_layer_classes
+
+
+@register('wms')
+def check_layer_indexes(app_configs, **kwargs):
+    """
+    Warns about layer tables without the indexes required for fast tile
+    queries or with stale statistics. This check queries the database, it
+    only runs if the WMS_CHECK_INDEXES setting is enabled.
+    """
+    if not getattr(settings, 'WMS_CHECK_INDEXES', False):
+        return []
+
+    warnings = []
+    for layer_class in get_layer_classes():
+        try:
+            report = LayerIndexReport(layer_class)
+            missing = report.get_missing_indexes()
+            stale = report.has_stale_statistics()
+        except DatabaseError as error:
+            warnings.append(Warning(
+                'Could not inspect the table of layer {0}: {1}'.format(layer_class.__name__, error),
+                obj=layer_class,
+                id='wms.W001',
+            ))
+            continue
+
+        for columns, method in missing:
+            warnings.append(Warning(
+                'Table {0} of layer {1} has no {2} index on {3}.'.format(
+                    report.table, layer_class.__name__, method, ', '.join(columns)
+                ),
+                hint='Run "manage.py wms_check_indexes --create" to create the index.',
+                obj=layer_class,
+                id='wms.W002',
+            ))
+
+        if stale:
+            warnings.append(Warning(
+                'Table {0} of layer {1} has stale statistics.'.format(report.table, layer_class.__name__),
+                hint='Run "manage.py wms_check_indexes --analyze" to update the statistics.',
+                obj=layer_class,
+                id='wms.W003',
+            ))
+
+    return warnings
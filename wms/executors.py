@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from django.db import connections
+from django.test.client import RequestFactory
+from django.utils.module_loading import import_string
+
+
+class RenderQueueFull(Exception):
+    """
+    Raised when a render job is submitted while the executor queue is full.
+    """
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when a render job does not finish within the executor timeout.
+    """
+
+
+class RenderError(Exception):
+    """
+    Raised when a render job failed in the worker process.
+    """
+
+
+# Database connections inherited from the parent process. They are kept
+# referenced, closing them would also end the session of the parent.
+_inherited_connections = []
+
+
+def reset_connections():
+    """
+    Detaches the database connections inherited by a forked worker, so that
+    the worker opens its own connections instead of sharing the sockets of
+    the parent process.
+    """
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+def warm_worker(view_paths):
+    """
+    Initializer for worker processes, resets the inherited database
+    connections and builds the map templates of all map classes that use
+    templates for the given view classes.
+    """
+    reset_connections()
+    request = RequestFactory().get('/')
+    for path in view_paths:
+        map_class = import_string(path).map_class
+        if map_class.use_template:
+            map_class(request).get_template()
+
+
+def render_job(job):
+    """
+    Renders a job in a worker process. The view and request are rebuilt from
+    the job description. Returns a (success, result) tuple, where result is
+    the rendered data and content type or the error message.
+    """
+    try:
+        view = import_string(job['view'])()
+        view.request = RequestFactory().get(
+            job['path'], HTTP_HOST=job['host'], secure=job['secure']
+        )
+        view.args = ()
+        view.kwargs = job['kwargs']
+        return True, view.render_ows(job['params'])
+    except Exception as error:
+        return False, '{0}: {1}'.format(error.__class__.__name__, error)
+
+
+class ProcessRenderExecutor(object):
+    """
+    Renders jobs in a pool of worker processes. At most max_queue jobs are
+    accepted at the same time, including the ones that are being rendered,
+    further jobs are rejected with RenderQueueFull. Jobs that take longer
+    than timeout seconds raise RenderTimeout, the worker finishes the job in
+    the background and its queue slot is released when it is done. If the
+    worker dies, the pool never reports the job as done, so the slots of
+    timed out jobs are reclaimed slot_timeout seconds after they were
+    submitted.
+
+    The pool is started on first use in each process. If warm_views is a
+    list of view class paths, the workers build the map templates of those
+    views on startup.
+    """
+    processes = None
+    max_queue = 64
+    timeout = 30
+    retry_after = 5
+    slot_timeout = 300
+
+    def __init__(self, processes=None, max_queue=None, timeout=None, retry_after=None, warm_views=None,
+                 slot_timeout=None):
+        if processes is not None:
+            self.processes = processes
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if timeout is not None:
+            self.timeout = timeout
+        if retry_after is not None:
+            self.retry_after = retry_after
+        if slot_timeout is not None:
+            self.slot_timeout = slot_timeout
+        self.warm_views = warm_views or []
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+        # Deadlines and release functions of the jobs that timed out
+        self._outstanding = {}
+
+    def get_pool(self):
+        """
+        Returns the process pool, starting it if this is the first job in the
+        current process.
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = multiprocessing.Pool(
+                    self.processes, initializer=warm_worker, initargs=(self.warm_views, )
+                )
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_queue)
+                self._outstanding = {}
+            return self._pool
+
+    def reclaim_slots(self):
+        """
+        Releases the queue slots of timed out jobs that are past their
+        deadline.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [job for job, (deadline, release) in self._outstanding.items() if deadline <= now]
+            releases = [self._outstanding.pop(job)[1] for job in expired]
+        for release in releases:
+            release()
+
+    def render(self, job):
+        """
+        Renders a job in the pool and returns the rendered data and content
+        type.
+        """
+        pool = self.get_pool()
+        slots = self._slots
+        self.reclaim_slots()
+
+        if not slots.acquire(False):
+            raise RenderQueueFull('Render queue is full.')
+
+        released = threading.Lock()
+        deadline = time.time() + self.slot_timeout
+        outstanding = self._outstanding
+        token = object()
+
+        def release(*args):
+            # Called by the pool callbacks, after reading the result and when
+            # the slot is reclaimed, the slot is released by whichever comes
+            # first
+            if released.acquire(False):
+                slots.release()
+                with self._lock:
+                    outstanding.pop(token, None)
+
+        callbacks = {'callback': release}
+        if sys.version_info >= (3, ):
+            callbacks['error_callback'] = release
+
+        try:
+            result = pool.apply_async(render_job, (job, ), **callbacks)
+        except Exception:
+            release()
+            raise
+
+        try:
+            success, value = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            # The job keeps its slot until the worker is done with it or the
+            # slot is reclaimed
+            with self._lock:
+                if not released.locked():
+                    outstanding[token] = (deadline, release)
+            raise RenderTimeout('Rendering took longer than {0} seconds.'.format(self.timeout))
+        except Exception:
+            release()
+            raise
+        release()
+
+        if not success:
+            raise RenderError(value)
+
+        return value
+
+    def close(self):
+        """
+        Stops the worker processes after all pending jobs are done.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
@@ -0,0 +1,194 @@
+from django.conf import settings
+from django.db import connections
+from wms.maps import WmsMap
+from wms.tilegrid import tile_bounds, tile_range
+
+try:
+    from django.urls import get_resolver
+except ImportError:
+    from django.core.urlresolvers import get_resolver
+
+# Columns of raster tile tables that are used to select tiles
+TILE_COLUMNS = ('tilez', 'tilex', 'tiley')
+
+# Share of modified rows after which table statistics are considered stale
+STALE_STATISTICS_RATIO = 0.1
+
+INDEX_SQL = '''
+    SELECT DISTINCT a.attname
+    FROM pg_index x
+    JOIN pg_class c ON c.oid = x.indrelid
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_am am ON am.oid = i.relam
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = ANY(x.indkey)
+    WHERE c.relname = %s AND am.amname = ANY(%s)
+'''
+
+STATISTICS_SQL = '''
+    SELECT COALESCE(last_analyze, last_autoanalyze), n_live_tup, n_mod_since_analyze
+    FROM pg_stat_user_tables WHERE relname = %s
+'''
+
+
+def get_url_map_classes(patterns=None):
+    """
+    Returns the map classes of the WMS views in the URLconf, including the
+    map classes passed to as_view. Loading the URLconf also imports the
+    modules that define the maps.
+    """
+    if patterns is None:
+        if not getattr(settings, 'ROOT_URLCONF', None):
+            return []
+        patterns = get_resolver().url_patterns
+
+    map_classes = []
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            map_classes.extend(get_url_map_classes(pattern.url_patterns))
+            continue
+        callback = getattr(pattern, 'callback', None)
+        initkwargs = getattr(callback, 'view_initkwargs', None) or {}
+        map_class = initkwargs.get('map_class', getattr(getattr(callback, 'view_class', None), 'map_class', None))
+        if isinstance(map_class, type) and issubclass(map_class, WmsMap):
+            map_classes.append(map_class)
+    return map_classes
+
+
+def get_map_classes():
+    """
+    Returns the map classes of the views in the URLconf and all imported
+    WmsMap subclasses, on all levels of inheritance.
+    """
+    map_classes = []
+    pending = get_url_map_classes() + WmsMap.__subclasses__()
+    while pending:
+        map_class = pending.pop(0)
+        if map_class not in map_classes:
+            map_classes.append(map_class)
+            pending.extend(map_class.__subclasses__())
+    return map_classes
+
+
+def get_layer_classes():
+    """
+    Returns all layer classes registered in the layer_classes of the WMS
+    maps returned by get_map_classes.
+    """
+    layer_classes = []
+    for map_class in get_map_classes():
+        for layer_class in map_class.layer_classes:
+            if layer_class not in layer_classes:
+                layer_classes.append(layer_class)
+    return layer_classes
+
+
+class LayerIndexReport(object):
+    """
+    Inspects the indexes and statistics of the table behind a layer class.
+    """
+
+    def __init__(self, layer_class):
+        self.layer = layer_class(None)
+        self.model = self.layer.model
+        self.table = self.model._meta.db_table
+        self.field = self.layer.get_spatial_field()
+        self.connection = connections[self.layer.using]
+        self.is_raster = self.field.__class__.__name__ == 'RasterField'
+
+    def get_indexed_columns(self, methods):
+        """
+        Returns the set of columns of the table that are part of an index of
+        one of the given access methods.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(INDEX_SQL, [self.table, list(methods)])
+            return set(row[0] for row in cursor.fetchall())
+
+    def get_missing_indexes(self):
+        """
+        Returns a list of (columns, method) tuples for the indexes that the
+        layer queries need but the table does not have.
+        """
+        missing = []
+        if self.is_raster:
+            indexed = self.get_indexed_columns(['btree'])
+            if not all(column in indexed for column in TILE_COLUMNS):
+                missing.append((TILE_COLUMNS, 'btree'))
+        elif self.field.column not in self.get_indexed_columns(['gist', 'spgist', 'brin']):
+            missing.append(((self.field.column, ), 'gist'))
+        return missing
+
+    def has_stale_statistics(self):
+        """
+        Returns true if the table was never analyzed or many rows changed
+        since the last analysis.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(STATISTICS_SQL, [self.table])
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        last_analyze, live, modified = row
+        return last_analyze is None or modified > STALE_STATISTICS_RATIO * max(live, 1)
+
+    def explain(self):
+        """
+        Returns the query plan of a sample tile query for this layer, using
+        the location of the first row of the table. Returns None if the table
+        is empty.
+        """
+        qn = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            if self.is_raster:
+                cursor.execute('SELECT tilex, tiley, tilez FROM {0} LIMIT 1'.format(qn(self.table)))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                sql = 'EXPLAIN SELECT {0} FROM {1} WHERE tilex = %s AND tiley = %s AND tilez = %s'.format(
+                    qn(self.model._meta.pk.column), qn(self.table)
+                )
+                cursor.execute(sql, list(row))
+            else:
+                cursor.execute(
+                    'SELECT ST_X(c), ST_Y(c) FROM (SELECT ST_Transform(ST_PointOnSurface({0}), 3857) AS c '
+                    'FROM {1} WHERE {0} IS NOT NULL LIMIT 1) AS sample'.format(qn(self.field.column), qn(self.table))
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                # Tile on zoom level 12 containing the sample point
+                x, y = self.get_sample_tile(row[0], row[1], 12)
+                sql = (
+                    'EXPLAIN SELECT {0} FROM {1} WHERE {2} && '
+                    'ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, 3857), %s)'
+                ).format(qn(self.model._meta.pk.column), qn(self.table), qn(self.field.column))
+                cursor.execute(sql, list(tile_bounds(x, y, 12)) + [self.field.srid])
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def get_sample_tile(self, x, y, z):
+        """
+        Returns the indices of the tile containing a spherical mercator point.
+        """
+        return tile_range(x, y, x, y, z)[:2]
+
+    def create_indexes(self):
+        """
+        Creates the missing indexes and returns their names.
+        """
+        qn = self.connection.ops.quote_name
+        created = []
+        with self.connection.cursor() as cursor:
+            for columns, method in self.get_missing_indexes():
+                name = '{0}_{1}_wms_idx'.format(self.table, '_'.join(columns))[:63]
+                cursor.execute('CREATE INDEX {0} ON {1} USING {2} ({3})'.format(
+                    qn(name), qn(self.table), method, ', '.join(qn(column) for column in columns)
+                ))
+                created.append(name)
+        return created
+
+    def analyze(self):
+        """
+        Updates the statistics of the table.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute('ANALYZE {0}'.format(self.connection.ops.quote_name(self.table)))
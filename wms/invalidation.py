@@ -0,0 +1,234 @@
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.gis.geos import Polygon
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.http import QueryDict
+from wms.cache import tile_key, tile_namespace
+from wms.tilegrid import lonlat_to_mercator, tile_range
+
+logger = logging.getLogger(__name__)
+
+
+class TileInvalidator(object):
+    """
+    Removes the cached tiles of a view that are affected by changes to the
+    models behind its layers.
+
+    When an instance of a layer model is saved or deleted, the envelope of
+    its old and new geometries is computed from the spatial field of the
+    layer, and all tiles covering that envelope on the configured zoom
+    levels are removed from the tile cache of the view. Purges are collected
+    and executed once the current transaction is committed, or in batches of
+    batch_size tiles.
+
+    Tiles are removed for each of the query strings in params, which default
+    to the tiles requested without any query parameters, and for each of the
+    formats, which include the vector tile format. The layer_sets are the comma separated layer names requested in
+    tile urls, tiles of all sets containing a changed layer are removed. By
+    default, each layer is requested on its own.
+    """
+    zooms = range(0, 19)
+    params = ('', )
+    formats = ('.png', '.jpg', '.pbf')
+    layer_sets = None
+    batch_size = 1000
+
+    def __init__(self, view_class, zooms=None, params=None, formats=None, layer_sets=None, batch_size=None):
+        self.view_class = view_class
+        if zooms is not None:
+            self.zooms = zooms
+        if params is not None:
+            self.params = params
+        if formats is not None:
+            self.formats = formats
+        if layer_sets is not None:
+            self.layer_sets = layer_sets
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_layer_classes(self, model=None):
+        """
+        Returns the layer classes of the view map, optionally only the ones
+        for the given model.
+        """
+        return [
+            layer for layer in self.view_class.map_class.layer_classes
+            if model is None or layer.model is model
+        ]
+
+    def get_stores(self):
+        """
+        Returns the tile stores of the view that hold rendered tiles.
+        """
+        view = self.view_class()
+        store = view.get_tile_store()
+        return [store] if store else []
+
+    def connect(self):
+        """
+        Connects the invalidation to the model signals of all layer models.
+        """
+        for model in set(layer.model for layer in self.get_layer_classes()):
+            uid = 'wms-invalidation-{0}'.format(id(self))
+            pre_save.connect(self.handle_pre_save, sender=model, dispatch_uid=uid)
+            post_save.connect(self.handle_change, sender=model, dispatch_uid=uid)
+            post_delete.connect(self.handle_change, sender=model, dispatch_uid=uid)
+
+    def disconnect(self):
+        """
+        Disconnects the invalidation from the model signals.
+        """
+        for model in set(layer.model for layer in self.get_layer_classes()):
+            uid = 'wms-invalidation-{0}'.format(id(self))
+            pre_save.disconnect(sender=model, dispatch_uid=uid)
+            post_save.disconnect(sender=model, dispatch_uid=uid)
+            post_delete.disconnect(sender=model, dispatch_uid=uid)
+
+    def handle_pre_save(self, sender, instance, using=None, **kwargs):
+        """
+        Invalidates the tiles covering the geometries that are about to be
+        replaced by an update, read from the database the instance is saved
+        to.
+        """
+        if instance.pk is None:
+            return
+        try:
+            old = sender._default_manager.db_manager(using).get(pk=instance.pk)
+        except sender.DoesNotExist:
+            return
+        except Exception:
+            logger.exception('Failed to read %s %s for tile invalidation', sender._meta.label, instance.pk)
+            return
+        self.handle_change(sender, old)
+
+    def handle_change(self, sender, instance, **kwargs):
+        """
+        Invalidates the tiles covering the geometries of a saved or deleted
+        instance. Failures are logged and do not break the save.
+        """
+        for layer in self.get_layer_classes(sender):
+            try:
+                field = layer(None).get_spatial_field()
+                value = getattr(instance, field.attname, None)
+                if value is not None:
+                    self.invalidate_extent(value.extent, value.srid, layers=[layer])
+            except Exception:
+                logger.exception('Failed to invalidate tiles of %s %s', sender._meta.label, instance.pk)
+
+    def invalidate_extent(self, extent, srid, layers=None):
+        """
+        Invalidates the tiles covering an extent given as (xmin, ymin, xmax,
+        ymax) tuple in the given srid, for the given layer classes or all
+        layers of the map. Use this method for changes that do not send model
+        signals, such as raw SQL loads or bulk updates. Latitudes are clipped
+        to the limits of spherical mercator.
+        """
+        if srid != 3857:
+            if srid != 4326:
+                envelope = Polygon.from_bbox(extent)
+                envelope.srid = srid
+                envelope.transform(4326)
+                extent = envelope.extent
+            extent = lonlat_to_mercator(*extent[:2]) + lonlat_to_mercator(*extent[2:])
+
+        names = set(layer(None).get_name() for layer in layers or self.get_layer_classes())
+        layer_sets = [layer_set for layer_set in self.get_layer_sets() if names & set(layer_set.split(','))]
+
+        self.purge(self.get_keys(tuple(extent), layer_sets))
+
+    def get_layer_sets(self):
+        """
+        Returns the comma separated layer names requested in tile urls.
+        """
+        if self.layer_sets is not None:
+            return self.layer_sets
+        return [layer(None).get_name() for layer in self.get_layer_classes()]
+
+    def get_keys(self, extent, layer_sets):
+        """
+        Generates the tile keys of the given layer sets covering an extent in
+        spherical mercator, so that large extents on high zoom levels do not
+        have to be kept in memory at once.
+        """
+        namespaces = [self.get_namespace(query) for query in self.params]
+        for z in self.zooms:
+            minx, miny, maxx, maxy = tile_range(*(extent + (z, )))
+            for x in range(minx, maxx + 1):
+                for y in range(miny, maxy + 1):
+                    for namespace in namespaces:
+                        for layer_set in layer_sets:
+                            for extension in self.formats:
+                                yield tile_key(namespace, layer_set, z, x, y, extension)
+
+    def get_key(self, query, layers, z, x, y, extension):
+        """
+        Returns the tile cache key of a tile requested with the given query
+        string, as computed by the view.
+        """
+        return tile_key(self.get_namespace(query), layers, z, x, y, extension)
+
+    def get_namespace(self, query):
+        """
+        Returns the tile namespace for tiles requested with the query string.
+        """
+        return tile_namespace(self.view_class.map_class, QueryDict(query).lists())
+
+    def purge(self, keys):
+        """
+        Schedules the given tile keys for removal. The tiles are removed when
+        the current transaction is committed, at the end of a batch block, or
+        as soon as batch_size keys are pending.
+        """
+        keys = iter(keys)
+        while True:
+            chunk = list(islice(keys, self.batch_size))
+            if not chunk:
+                break
+            with self._lock:
+                self._pending.update(chunk)
+                full = len(self._pending) >= self.batch_size
+            if full:
+                self.flush()
+
+        if self._pending and not getattr(self._local, 'batching', False):
+            transaction.on_commit(self.flush_on_commit)
+
+    def flush(self):
+        """
+        Removes all pending tiles from the tile stores.
+        """
+        with self._lock:
+            keys, self._pending = self._pending, set()
+        for store in self.get_stores():
+            for key in keys:
+                store.delete(key)
+
+    def flush_on_commit(self):
+        """
+        Removes all pending tiles after a commit. Failures are logged, so
+        that they do not surface in the code that committed the changes.
+        """
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to remove invalidated tiles')
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that defers all purges until the end of the block,
+        for instance when loading many records.
+        """
+        self._local.batching = True
+        try:
+            yield
+        finally:
+            self._local.batching = False
+            self.flush()
@@ -1,7 +1,17 @@
+import re
+import uuid
+
 import mapscript
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.gdal.libgdal import lgdal
+from django.db import connections
+from django.utils.encoding import force_bytes
+from wms.cache import MemoryTileCache
+from wms.capabilities import get_extent, get_generation, get_last_modified
+from wms.singleflight import SingleFlight
+from wms.tilegrid import MERCATOR_GRID, tile_bounds
 
 
 def to_hex(color):
@@ -15,6 +25,24 @@ def to_hex(color):
     return color
 
 
+def expression_filter(expression):
+    """
+    Converts simple mapserver class expressions comparing an attribute to a
+    value, such as ([category] = 1) or ("[name]" = "park"), into a style
+    filter. Returns None for other expressions.
+    """
+    match = re.match(r'^\(\s*"?\[(\w+)\]"?\s*(==|=|!=|<=|>=|<|>)\s*("?)([^"]*)\3\s*\)$', expression or '')
+    if not match:
+        return None
+    field, operator, quote, value = match.groups()
+    if not quote:
+        try:
+            value = float(value) if '.' in value else int(value)
+        except ValueError:
+            return None
+    return [{'=': '=='}.get(operator, operator), ['get', field], value]
+
+
 class WmsBaseLayer(object):
     """
     Base class representing mapserver layers. Use this class to serve data
@@ -24,12 +52,9 @@ class WmsBaseLayer(object):
     field to use can also be specified explicitly using geo_field_name.
     """
     # wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Resolution_and_Scale
-    ZOOM_METER_PER_PIXEL = {
-        '0': 156543.03, '1': 78271.52, '2': 39135.76, '3': 19567.88, '4': 9783.94,
-        '5': 4891.97, '6': 2445.98, '7': 1222.99, '8': 611.50, '9': 305.75, '10': 152.87,
-        '11': 76.437, '12': 38.219, '13': 19.109, '14': 9.5546, '15': 4.7773,
-        '16': 2.3887, '17': 1.1943, '18': 0.5972
-    }
+    ZOOM_METER_PER_PIXEL = dict(
+        (str(zoom), float(resolution)) for zoom, resolution in enumerate(MERCATOR_GRID.resolutions(30))
+    )
 
     model = None
     name = None
@@ -39,6 +64,11 @@ class WmsBaseLayer(object):
     cartography = []
     classitem = None
     geo_field_options = []
+    using = 'default'
+    last_modified_field = None
+    last_modified_timeout = 5
+    extent_timeout = 300
+    cache_max_age = None
 
     def __init__(self, request, **kwargs):
         # Set request and request args as object properties
@@ -91,6 +121,42 @@ class WmsBaseLayer(object):
         """
         return str(self.get_spatial_field().srid)
 
+    def get_last_modified(self):
+        """
+        Returns the latest value of the last_modified_field of the model, or
+        None if no such field was specified.
+        """
+        version = self.get_data_version()
+        return version and version[0]
+
+    def get_data_version(self):
+        """
+        Returns the latest value of the last_modified_field and the data
+        generation of the model, or None if no last_modified_field was
+        specified. The generation also changes on deletes, which the latest
+        change does not.
+        """
+        if not self.last_modified_field:
+            return None
+        last_modified = get_last_modified(
+            self.model, self.last_modified_field, self.using, self.last_modified_timeout
+        )
+        return last_modified, get_generation([self.model])
+
+    def get_extent(self):
+        """
+        Returns the extent of the layer data in the layer srs, or None if it
+        is not known. The extent is cached until the data generation of the
+        layer model changes, or for at most extent_timeout seconds.
+        """
+        return get_extent(self.model, self.get_spatial_field().name, self.using, self.extent_timeout)
+
+    def get_database_settings(self):
+        """
+        Returns the settings of the database that holds the layer data.
+        """
+        return settings.DATABASES[self.using]
+
     def get_base_layer(self):
         """
         Instantiates and returns a base WMS layer with attributes that are
@@ -110,6 +176,14 @@ class WmsBaseLayer(object):
 
         return layer
 
+    def update_layer(self, layer):
+        """
+        Updates the request dependent properties of a layer object that was
+        cloned from a map template. Layers whose mapscript objects do not
+        depend on the request leave the layer unchanged.
+        """
+        pass
+
 
 class WmsVectorLayer(WmsBaseLayer):
     """
@@ -129,6 +203,42 @@ class WmsVectorLayer(WmsBaseLayer):
         'MultiPolygonField': mapscript.MS_LAYER_POLYGON
     }
 
+    dsn = None
+    defer_connection = False
+    min_scale = None
+    max_scale = None
+    simplify_tolerance = None
+    generalized_sources = []
+    filters = {}
+    mvt_fields = []
+    mvt_extent = 4096
+    mvt_buffer = 64
+
+    # Approximate length of a degree at the equator, to convert tolerances
+    # for layers in geographic coordinates.
+    METERS_PER_DEGREE = 111319.49
+
+    def get_connection_string(self):
+        """
+        Returns the libpq connection string for the layer database, or the
+        dsn attribute if specified.
+        """
+        if self.dsn:
+            return self.dsn
+
+        database = self.get_database_settings()
+        connection_template = (
+            'host={host} dbname={dbname} user={user} '
+            'port={port} password={password}'
+        )
+        return connection_template.format(
+            host=database['HOST'],
+            dbname=database['NAME'],
+            user=database['USER'],
+            port=database['PORT'],
+            password=database['PASSWORD']
+        )
+
     def get_vector_layer(self, field_name):
         """
         Connect this layer to a vector data model.
@@ -140,20 +250,20 @@ class WmsVectorLayer(WmsBaseLayer):
 
         # Set connection to DB
         layer.setConnectionType(mapscript.MS_POSTGIS, '')
-        connection_template = (
-            'host={host} dbname={dbname} user={user} '
-            'port={port} password={password}'
-        )
-        layer.connection = connection_template.format(
-            host=settings.DATABASES['default']['HOST'],
-            dbname=settings.DATABASES['default']['NAME'],
-            user=settings.DATABASES['default']['USER'],
-            port=settings.DATABASES['default']['PORT'],
-            password=settings.DATABASES['default']['PASSWORD']
-        )
+        layer.connection = self.get_connection_string()
+
+        # Keep the connection open in the mapserver connection pool
+        if self.defer_connection:
+            layer.addProcessing('CLOSE_CONNECTION=DEFER')
 
         # Select data column
-        layer.data = 'geom FROM {0}'.format(self.model._meta.db_table)
+        layer.data = self.get_vector_data()
+
+        # Only draw layer within the scale range
+        if self.min_scale:
+            layer.minscaledenom = self.min_scale
+        if self.max_scale:
+            layer.maxscaledenom = self.max_scale
 
         # Set class item
         if self.classitem:
@@ -186,6 +296,299 @@ class WmsVectorLayer(WmsBaseLayer):
 
         return layer
 
+    def update_layer(self, layer):
+        """
+        Selects the data source for the zoom level of the request if the
+        layer is generalized.
+        """
+        if self.simplify_tolerance or self.generalized_sources:
+            layer.data = self.get_vector_data()
+
+    def get_vector_data(self):
+        """
+        Returns the mapserver DATA statement for this layer.
+
+        The statement selects the spatial field of the model and declares
+        the primary key and the srid, so that mapserver does not need to
+        look them up for every request. The where attribute and the filters
+        are applied in a subquery together with the !BOX! bounding box
+        predicate, so that the spatial index is used.
+
+        If generalized sources are specified, the first source whose maximum
+        zoom level is not below the zoom level of the request is used. If a
+        simplification tolerance is specified, geometries are simplified on
+        the fly.
+        """
+        pk = self.model._meta.pk.column
+        srid = self.get_srs()
+
+        zoom = self.get_zoom()
+        table, column = self.get_source(zoom)
+
+        simplify = zoom is not None and self.simplify_tolerance
+        filter_sql = self.get_filter_sql()
+
+        if not (simplify or self.where or filter_sql):
+            return '{0} FROM {1} USING UNIQUE {2} USING SRID={3}'.format(column, table, pk, srid)
+
+        # Select all columns, they might be used in class expressions
+        select = '*'
+        if simplify:
+            select += ', ST_SimplifyPreserveTopology({0}, {1!r}) AS wms_geom'.format(
+                column, self.get_tolerance(zoom)
+            )
+
+        conditions = ['{0} && !BOX!'.format(column)]
+        if self.where:
+            conditions.append('({0})'.format(self.where))
+        if filter_sql:
+            conditions.append('{0} IN ({1})'.format(pk, filter_sql))
+
+        data_template = (
+            '{geom} FROM (SELECT {select} FROM {table} WHERE {conditions}) AS wms_source '
+            'USING UNIQUE {pk} USING SRID={srid}'
+        )
+        return data_template.format(
+            geom='wms_geom' if simplify else column,
+            select=select,
+            table=table,
+            conditions=' AND '.join(conditions),
+            pk=pk,
+            srid=srid,
+        )
+
+    def get_source(self, zoom):
+        """
+        Returns the table and geometry column to read the layer data from on
+        the given zoom level, taking the generalized sources into account.
+        """
+        table = self.model._meta.db_table
+        column = self.get_spatial_field().column
+        if zoom is not None:
+            for max_zoom, source_table, source_column in sorted(self.generalized_sources):
+                if zoom <= max_zoom:
+                    return source_table or table, source_column or column
+        return table, column
+
+    def get_mvt_fields(self):
+        """
+        Returns the columns included as attributes in vector tiles. These are
+        the primary key, the mvt_fields, the classitem and the attributes
+        used in the cartography expressions.
+        """
+        fields = [self.model._meta.pk.column] + list(self.mvt_fields)
+        if self.classitem:
+            fields.append(self.classitem)
+        for cart in self.cartography:
+            fields.extend(re.findall(r'\[(\w+)\]', cart.get('expression', '')))
+
+        columns = [field.column for field in self.model._meta.concrete_fields]
+        result = []
+        for field in fields:
+            if field in columns and field not in result:
+                result.append(field)
+        return result
+
+    def get_mvt_sql(self, x, y, z):
+        """
+        Returns the query encoding the features of the given XYZ tile as a
+        Mapbox Vector Tile layer. The geometries are clipped and quantized
+        to the tile by ST_AsMVTGeom, only features within the tile and its
+        buffer are selected so that the spatial index is used.
+        """
+        quote = connections[self.using].ops.quote_name
+        table, column = self.get_source(z)
+        pk = self.model._meta.pk.column
+        srid = int(self.get_srs())
+
+        minx, miny, maxx, maxy = tile_bounds(x, y, z)
+        margin = (maxx - minx) * self.mvt_buffer / float(self.mvt_extent)
+        envelope = 'ST_MakeEnvelope({0!r}, {1!r}, {2!r}, {3!r}, 3857)'
+        bounds = envelope.format(minx, miny, maxx, maxy)
+        search = envelope.format(minx - margin, miny - margin, maxx + margin, maxy + margin)
+        geom = quote(column)
+        if srid != 3857:
+            search = 'ST_Transform({0}, {1})'.format(search, srid)
+            geom = 'ST_Transform({0}, 3857)'.format(geom)
+
+        conditions = ['{0} && {1}'.format(quote(column), search)]
+        if self.where:
+            conditions.append('({0})'.format(self.where))
+        filter_sql = self.get_filter_sql()
+        if filter_sql:
+            conditions.append('{0} IN ({1})'.format(quote(pk), filter_sql))
+
+        mvt_template = (
+            'SELECT ST_AsMVT(wms_tile, %s, {extent}, \'wms_geom\') FROM ('
+            'SELECT {fields}, ST_AsMVTGeom({geom}, {bounds}, {extent}, {buffer}, true) AS wms_geom '
+            'FROM {table} WHERE {conditions}'
+            ') AS wms_tile WHERE wms_geom IS NOT NULL'
+        )
+        sql = mvt_template.format(
+            extent=int(self.mvt_extent),
+            buffer=int(self.mvt_buffer),
+            fields=', '.join([quote(field) for field in self.get_mvt_fields()]),
+            geom=geom,
+            bounds=bounds,
+            table=table,
+            # Literal percent signs must not be read as parameters
+            conditions=' AND '.join(conditions).replace('%', '%%'),
+        )
+        return sql, [self.get_name()]
+
+    def get_mvt(self, x, y, z):
+        """
+        Returns the encoded vector tile layer for the given XYZ tile, which
+        is empty if there are no features in the tile.
+        """
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(*self.get_mvt_sql(x, y, z))
+            data = cursor.fetchone()[0]
+        return bytes(data) if data else b''
+
+    def get_style_layers(self, source):
+        """
+        Returns the cartography of this layer as style layers for vector
+        tile clients, one for each category. Categories whose expressions
+        can not be converted keep the expression in the metadata.
+        """
+        field_name = self.get_spatial_field().__class__.__name__
+        layer_type = {'PointField': 'circle', 'LineStringField': 'line'}.get(field_name, 'fill')
+        name = self.get_name()
+
+        style_layers = []
+        for index, cart in enumerate(self.cartography or [{'name': name}]):
+            color = to_hex(cart.get('color', '#777777'))
+            outlinecolor = to_hex(cart.get('outlinecolor', '#000000'))
+            width = cart.get('width', 1)
+            if layer_type == 'fill':
+                paint = {'fill-color': color, 'fill-outline-color': outlinecolor}
+            elif layer_type == 'line':
+                paint = {'line-color': color, 'line-width': width}
+            else:
+                paint = {'circle-color': color, 'circle-stroke-color': outlinecolor, 'circle-stroke-width': width}
+
+            style_layer = {
+                'id': '{0}-{1}'.format(name, index),
+                'type': layer_type,
+                'source': source,
+                'source-layer': name,
+                'paint': paint,
+                'metadata': {'name': cart.get('name', cart.get('expression', ''))},
+            }
+            if cart.get('expression'):
+                style_filter = expression_filter(cart['expression'])
+                if style_filter:
+                    style_layer['filter'] = style_filter
+                else:
+                    style_layer['metadata']['expression'] = cart['expression']
+            style_layers.append(style_layer)
+        return style_layers
+
+    def get_queryset(self):
+        """
+        Returns the queryset selecting the features of this layer, by
+        default the layer model filtered by the filters attribute. Override
+        this method for more complex lookups.
+        """
+        return self.model._default_manager.using(self.using).filter(**self.filters)
+
+    def get_filter_sql(self):
+        """
+        Returns the SQL selecting the primary keys of the features of this
+        layer, with parameters quoted by the database adapter. Returns None
+        if the layer has no filters.
+        """
+        if not self.filters and self.__class__.get_queryset == WmsVectorLayer.get_queryset:
+            return None
+
+        sql, params = self.get_queryset().values('pk').query.sql_with_params()
+        with connections[self.using].cursor() as cursor:
+            sql = cursor.mogrify(sql, params)
+
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8')
+        return sql
+
+    def get_tolerance(self, zoom):
+        """
+        Returns the simplification tolerance in units of the layer srs. The
+        simplify_tolerance is given in pixels and converted using the pixel
+        size of the zoom level, zoom levels beyond the most detailed one use
+        its pixel size.
+        """
+        zoom = min(max(int(zoom), 0), len(self.ZOOM_METER_PER_PIXEL) - 1)
+        tolerance = self.simplify_tolerance * self.ZOOM_METER_PER_PIXEL[str(zoom)]
+        if self.get_spatial_field().geodetic(connections[self.using]):
+            tolerance /= self.METERS_PER_DEGREE
+        return tolerance
+
+    def get_zoom(self):
+        """
+        Returns the zoom level of the request. For tile requests this is the
+        requested zoom level, for WMS requests the first zoom level that is
+        at least as detailed as the resolution of the requested bounding box
+        and image width. Returns None if the zoom level can not be determined.
+        """
+        if self.kwargs.get('z'):
+            return int(self.kwargs['z'])
+
+        if self.request is None:
+            return None
+
+        params = dict((key.upper(), value) for key, value in self.request.GET.items())
+        try:
+            minx, miny, maxx, maxy = [float(coord) for coord in params['BBOX'].split(',')]
+            resolution = (maxx - minx) / float(params['WIDTH'])
+        except (KeyError, ValueError, ZeroDivisionError):
+            return None
+
+        srs = params.get('SRS', params.get('CRS', '')).upper()
+        if srs in ('EPSG:4326', 'CRS:84'):
+            resolution *= self.METERS_PER_DEGREE
+
+        zoom = int(MERCATOR_GRID.zoom_for_resolution(abs(resolution)))
+        return min(zoom, len(self.ZOOM_METER_PER_PIXEL) - 1)
+
+
+class RasterMemoryCache(MemoryTileCache):
+    """
+    Memory cache for in-memory raster copies, removing the /vsimem/ file of
+    a raster once it leaves the cache. Older Django versions do not remove
+    these files when the raster object is garbage collected.
+
+    Rasters expire after timeout seconds, to pick up changes that are not
+    part of the data generation.
+    """
+    timeout = 300
+
+    def __init__(self, timeout=None, max_entries=None):
+        super(RasterMemoryCache, self).__init__(timeout=timeout, max_entries=max_entries)
+        self.loads = SingleFlight()
+
+    def get_or_load(self, key, load):
+        """
+        Returns the raster for the given key, loading and storing it with
+        the load function on a miss. Concurrent misses for the same key share
+        a single load, so a raster that is being rendered is never replaced.
+        """
+        raster = self.get(key)
+        if raster is None:
+            raster = self.loads.do(key, lambda: self._load(key, load))
+        return raster
+
+    def _load(self, key, load):
+        # Keep a raster stored by a load that finished in the meantime
+        raster = self.peek(key)
+        if raster is None:
+            raster = load()
+            if raster is not None:
+                self.set(key, raster)
+        return raster
+
+    def removed(self, key, raster):
+        lgdal.VSIUnlink(force_bytes(raster.name))
+
 
 class WmsRasterLayer(WmsBaseLayer):
     """
@@ -195,6 +598,11 @@ class WmsRasterLayer(WmsBaseLayer):
 
     geo_field_options = [models.RasterField]
 
+    memory_source = False
+
+    # Process wide store of in-memory copies of raster tiles
+    raster_cache = RasterMemoryCache(max_entries=256)
+
     def get_raster_layer(self):
         """
         Connect this layer to a raster model.
@@ -209,23 +617,57 @@ class WmsRasterLayer(WmsBaseLayer):
         else:
             layer.classitem = "[pixel]"
 
+        # Set data source
+        layer.data = self.get_raster_data()
+
+        # Set nodata if provided
+        if self.nodata:
+            layer.addProcessing("NODATA=" + self.nodata)
+
+        # Get cartography
+        layer = self.set_cartography(layer)
+
+        return layer
+
+    def get_extent(self):
+        """
+        Raster extents are left to mapserver.
+        """
+        return None
+
+    def update_layer(self, layer):
+        """
+        Points the data source of the layer to the requested tile.
+        """
+        layer.data = self.get_raster_data()
+
+    def get_raster_data(self):
+        """
+        Returns the GDAL data source string for the requested tile. In memory
+        source mode, this is the path of an in-memory copy of the tile.
+        """
         x = self.kwargs.get('x')
         y = self.kwargs.get('y')
         z = self.kwargs.get('z')
 
-        # Set data source
+        if self.memory_source and z:
+            path = self.get_memory_data(x, y, z)
+            if path:
+                return path
+
         layer_data_template = (
             "PG:host='{host}' dbname='{dbname}' user='{user}' "
             "port='{port}' password='{password}' mode=1 "
             "where='tilex={x} AND tiley={y} AND tilez={z} AND {where}' "
             "table='{db_table}'"
         )
-        layer.data = layer_data_template.format(
-            host=settings.DATABASES['default']['HOST'],
-            dbname=settings.DATABASES['default']['NAME'],
-            user=settings.DATABASES['default']['USER'],
-            port=settings.DATABASES['default']['PORT'],
-            password=settings.DATABASES['default']['PASSWORD'],
+        database = self.get_database_settings()
+        return layer_data_template.format(
+            host=database['HOST'],
+            dbname=database['NAME'],
+            user=database['USER'],
+            port=database['PORT'],
+            password=database['PASSWORD'],
             x=x,
             y=y,
             z=z,
@@ -233,14 +675,41 @@ class WmsRasterLayer(WmsBaseLayer):
             db_table=self.model._meta.db_table
         )
 
-        # Set nodata if provided
-        if self.nodata:
-            layer.addProcessing("NODATA=" + self.nodata)
+    def get_memory_data(self, x, y, z):
+        """
+        Returns the /vsimem/ path of an in-memory copy of the requested tile,
+        or None if the tile does not exist. The copies are kept in the
+        raster_cache until they are evicted or expire, or the data generation
+        of the layer model changes.
+        """
+        key = '{0}/{1}/{2}/{3}/{4}/{5}/{6}'.format(
+            self.using, self.model._meta.db_table, get_generation([self.model]), self.where, z, x, y
+        )
+        raster = self.raster_cache.get_or_load(key, lambda: self.load_raster(x, y, z))
+        if raster is None:
+            return None
 
-        # Get cartography
-        layer = self.set_cartography(layer)
+        # Keep a reference to the raster for as long as the layer is used.
+        # Evicted tiles are removed from /vsimem/, so the raster_cache has to
+        # hold more tiles than are rendered at the same time.
+        self.memory_raster = raster
+        return raster.name
 
-        return layer
+    def load_raster(self, x, y, z):
+        """
+        Fetches the requested tile through the ORM and copies it into a new
+        in-memory GeoTIFF. Returns None if the tile does not exist.
+        """
+        queryset = self.model._default_manager.using(self.using).filter(tilex=x, tiley=y, tilez=z)
+        if self.where:
+            # The where clause is escaped for the GDAL connection string
+            queryset = queryset.extra(where=[self.where.replace("\\'", "'")])
+
+        raster = queryset.values_list(self.get_spatial_field().name, flat=True).first()
+        if raster is None:
+            return None
+
+        return raster.warp({'driver': 'GTiff', 'name': '/vsimem/wms-{0}.tif'.format(uuid.uuid4().hex)})
 
     def set_cartography(self, layer):
         """
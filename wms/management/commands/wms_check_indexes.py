@@ -0,0 +1,65 @@
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from wms.indexes import LayerIndexReport, get_layer_classes
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Checks the spatial and tile indexes and the statistics of the tables '
+        'behind all layers registered in a WmsMap, optionally creating the '
+        'missing indexes and updating the statistics.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'maps', nargs='*',
+            help='Dotted paths to modules or WmsMap subclasses to import before collecting layers.'
+        )
+        parser.add_argument('--create', action='store_true', help='Create missing indexes.')
+        parser.add_argument('--analyze', action='store_true', help='Update stale table statistics.')
+        parser.add_argument('--explain', action='store_true', help='Show the plan of a sample tile query.')
+
+    def handle(self, *args, **options):
+        # Importing maps registers them as WmsMap subclasses
+        for path in options['maps']:
+            try:
+                import_string(path)
+            except ImportError:
+                import_module(path)
+
+        layer_classes = get_layer_classes()
+        if not layer_classes:
+            self.stdout.write('No layers found, specify the modules that define the maps.')
+            return
+
+        for layer_class in layer_classes:
+            report = LayerIndexReport(layer_class)
+            self.stdout.write('{0} ({1})'.format(layer_class.__name__, report.table))
+
+            missing = report.get_missing_indexes()
+            for columns, method in missing:
+                self.stdout.write('  Missing {0} index on {1}'.format(method, ', '.join(columns)))
+            if missing and options['create']:
+                for name in report.create_indexes():
+                    self.stdout.write('  Created index {0}'.format(name))
+
+            if report.has_stale_statistics():
+                self.stdout.write('  Statistics are stale')
+                if options['analyze']:
+                    report.analyze()
+                    self.stdout.write('  Updated statistics')
+
+            if not missing:
+                self.stdout.write('  Indexes OK')
+
+            if options['explain']:
+                plan = report.explain()
+                if plan is None:
+                    self.stdout.write('  Table is empty, no sample query')
+                else:
+                    self.stdout.write('  Sample tile query plan:')
+                    for line in plan.splitlines():
+                        self.stdout.write('    ' + line)
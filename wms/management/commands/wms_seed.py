@@ -0,0 +1,271 @@
+import logging
+import multiprocessing
+import os
+import time
+
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.client import RequestFactory
+from django.utils.module_loading import import_string
+from wms.cache import FileSystemTileCache, MBTilesTileCache
+from wms.maps import WmsMap
+from wms.tilegrid import lonlat_to_mercator, tile_bounds, tile_range
+from wms.views import WmsView
+
+FORMATS = {'png': 'image/png', 'jpg': 'image/jpeg'}
+
+# Number of failed tiles listed in the summary
+ERROR_SAMPLE_SIZE = 10
+
+logger = logging.getLogger(__name__)
+
+# State of the seeding process, set up once per worker
+_worker = {}
+
+
+def get_view_class(path):
+    """
+    Returns a WmsView subclass for a dotted path to a view or map class.
+    """
+    klass = import_string(path)
+    if issubclass(klass, WmsView):
+        return klass
+    elif issubclass(klass, WmsMap):
+        return type('SeedView', (WmsView, ), {'map_class': klass})
+    raise CommandError('{0} is neither a WmsView nor a WmsMap subclass.'.format(path))
+
+
+def get_cache(location, mbtiles):
+    """
+    Returns the tile store to seed into, an MBTiles package if a package
+    path is given and a z/x/y directory tree otherwise.
+    """
+    if mbtiles:
+        return MBTilesTileCache(mbtiles, readonly=False)
+    return FileSystemTileCache(location)
+
+
+def init_worker(path, location, layers, extension, host, resume, mbtiles=None):
+    """
+    Sets up the view class and tile store for seeding in this process.
+    """
+    _worker.update({
+        'view_class': get_view_class(path),
+        'cache': get_cache(location, mbtiles),
+        'layers': layers,
+        'extension': extension,
+        'host': host,
+        'resume': resume,
+    })
+
+
+def seed_tile(tile):
+    """
+    Renders a single tile into the tile store. Returns the tile status, one
+    of rendered, skipped, empty or error, and an error message for failed
+    tiles.
+    """
+    x, y, z = tile
+    view = _worker['view_class']()
+    view.request = RequestFactory().get('/', HTTP_HOST=_worker['host'])
+    view.args = ()
+    view.kwargs = {
+        'layers': _worker['layers'],
+        'x': str(x), 'y': str(y), 'z': str(z),
+        'format': _worker['extension'],
+    }
+
+    cache = _worker['cache']
+    key = view.get_tile_cache_key(x, y, z)
+    if _worker['resume']:
+        if isinstance(cache, FileSystemTileCache):
+            exists = os.path.exists(cache.get_path(key))
+        else:
+            exists = cache.peek(key) is not None
+        if exists:
+            return 'skipped', None
+
+    if not view.tile_exists(x, y, z):
+        return 'empty', None
+
+    format = FORMATS[_worker['extension'][1:]]
+    try:
+        data, contenttype = view.render_ows(view.get_tile_request_data(format, view.get_tile_bounds(x, y, z)))
+    except Exception as error:
+        # A failing tile does not stop the run, it is counted as error
+        logger.exception('Failed to render tile %s/%s/%s', z, x, y)
+        return 'error', '{0}/{1}/{2}: {3}: {4}'.format(z, x, y, error.__class__.__name__, error)
+    if contenttype != format:
+        body = data[:500].decode('utf-8', 'replace').strip()
+        logger.error('Tile %s/%s/%s was rendered as %s: %s', z, x, y, contenttype, body)
+        return 'error', '{0}/{1}/{2}: rendered as {3}: {4}'.format(z, x, y, contenttype, body)
+
+    cache.set(key, data)
+    return 'rendered', None
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Renders the tiles of a map over a zoom range into a z/x/y directory '
+        'tree or an MBTiles package that can be served through a WmsView tile '
+        'cache.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('map', help='Dotted path to a WmsMap or WmsView subclass.')
+        parser.add_argument('--layers', required=True, help='Layer name as used in the tile urls.')
+        parser.add_argument('--zoom', required=True, help='Zoom level or range, for instance 5 or 0-12.')
+        parser.add_argument('--bbox', help='Area to seed as minlon,minlat,maxlon,maxlat. Defaults to the world.')
+        parser.add_argument('--polygon', help='Area to seed as WKT or GeoJSON polygon, EPSG:4326 if no srid is given.')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='png', help='Tile image format.')
+        parser.add_argument('--location', help='Tile directory, defaults to the location of the view tile cache.')
+        parser.add_argument('--mbtiles', help='Path of an MBTiles package to write the tiles into.')
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='Number of worker processes.')
+        parser.add_argument('--resume', action='store_true', help='Skip tiles that are already in the tile directory.')
+        parser.add_argument('--host', default='localhost', help='Host name used for the rendering requests.')
+        parser.add_argument('--progress', type=float, default=10, help='Seconds between progress reports.')
+
+    def handle(self, *args, **options):
+        view_class = get_view_class(options['map'])
+
+        location = options['location']
+        if options['mbtiles']:
+            if location:
+                raise CommandError('Specify either a location or an MBTiles package.')
+            location = options['mbtiles']
+        elif not location:
+            if not isinstance(view_class.tile_cache, FileSystemTileCache):
+                raise CommandError('Specify a location, the view does not have a file system tile cache.')
+            location = view_class.tile_cache.location
+
+        zooms = self.parse_zoom(options['zoom'])
+        area = self.parse_area(options['bbox'], options['polygon'])
+        total = sum(self.count_tiles(area, z) for z in zooms)
+
+        self.stdout.write('Seeding up to {0} tiles into {1}'.format(total, location))
+
+        initargs = (
+            options['map'], location, options['layers'], '.' + options['format'],
+            options['host'], options['resume'], options['mbtiles'],
+        )
+        tiles = self.get_tiles(area, zooms)
+
+        if options['processes'] > 1:
+            # Worker processes have to open their own database connections
+            for connection in connections.all():
+                connection.close()
+            pool = multiprocessing.Pool(options['processes'], initializer=init_worker, initargs=initargs)
+            results = pool.imap_unordered(seed_tile, tiles, chunksize=16)
+        else:
+            pool = None
+            init_worker(*initargs)
+            results = (seed_tile(tile) for tile in tiles)
+
+        counts = dict((status, 0) for status in ('rendered', 'skipped', 'empty', 'error'))
+        errors = []
+        start = last_report = time.time()
+        try:
+            for status, message in results:
+                counts[status] += 1
+                if message and len(errors) < ERROR_SAMPLE_SIZE:
+                    errors.append(message)
+                if time.time() - last_report >= options['progress']:
+                    last_report = time.time()
+                    self.report(counts, total, start)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        self.report(counts, total, start)
+        self.report_errors(errors, counts['error'])
+
+        if options['mbtiles']:
+            self.write_metadata(MBTilesTileCache(options['mbtiles'], readonly=False), area, zooms)
+
+    def write_metadata(self, package, area, zooms):
+        """
+        Stores the bounds and zoom range of the seeded area in the package.
+        """
+        area = area.transform(4326, clone=True)
+        package.set_metadata(
+            bounds=','.join([repr(coord) for coord in area.extent]),
+            minzoom=min(zooms),
+            maxzoom=max(zooms),
+        )
+
+    def parse_zoom(self, zoom):
+        """
+        Returns the list of zoom levels from a level or range string.
+        """
+        try:
+            levels = [int(level) for level in zoom.split('-')]
+        except ValueError:
+            raise CommandError('Invalid zoom range {0}.'.format(zoom))
+        return list(range(levels[0], levels[-1] + 1))
+
+    def parse_area(self, bbox, polygon):
+        """
+        Returns the area to seed as a polygon in spherical mercator.
+        """
+        if polygon:
+            geom = GEOSGeometry(polygon)
+            if not geom.srid:
+                geom.srid = 4326
+            geom.transform(3857)
+            return geom
+
+        if bbox:
+            try:
+                minlon, minlat, maxlon, maxlat = [float(coord) for coord in bbox.split(',')]
+            except ValueError:
+                raise CommandError('Invalid bbox {0}.'.format(bbox))
+        else:
+            minlon, minlat, maxlon, maxlat = -180, -90, 180, 90
+
+        area = Polygon.from_bbox(lonlat_to_mercator(minlon, minlat) + lonlat_to_mercator(maxlon, maxlat))
+        area.srid = 3857
+        return area
+
+    def count_tiles(self, area, z):
+        """
+        Returns the number of tiles in the range covering the area.
+        """
+        minx, miny, maxx, maxy = tile_range(*(area.extent + (z, )))
+        return (maxx - minx + 1) * (maxy - miny + 1)
+
+    def get_tiles(self, area, zooms):
+        """
+        Yields the x, y, z indices of all tiles intersecting the area.
+        """
+        prepared = area.prepared
+        is_box = area.equals(Polygon.from_bbox(area.extent))
+        for z in zooms:
+            minx, miny, maxx, maxy = tile_range(*(area.extent + (z, )))
+            for x in range(minx, maxx + 1):
+                for y in range(miny, maxy + 1):
+                    if is_box or prepared.intersects(Polygon.from_bbox(tile_bounds(x, y, z))):
+                        yield x, y, z
+
+    def report(self, counts, total, start):
+        """
+        Writes a progress line with tile counts and throughput.
+        """
+        done = sum(counts.values())
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write(
+            '{done}/{total} tiles, {rendered} rendered, {empty} empty, {skipped} skipped, '
+            '{error} errors, {rate:.1f} tiles/s'.format(done=done, total=total, rate=done / elapsed, **counts)
+        )
+
+    def report_errors(self, errors, count):
+        """
+        Writes the messages of a sample of the failed tiles.
+        """
+        if not errors:
+            return
+        self.stdout.write('Errors of {0} of {1} failed tiles:'.format(len(errors), count))
+        for message in errors:
+            self.stdout.write('  ' + message)
@@ -1,7 +1,10 @@
+import threading
+
 import mapscript
 
 from django.conf import settings
 
+from .metrics import timer
 from .symbols import WmsSymbolSet
 
 
@@ -16,6 +19,12 @@ class WmsMap(object):
     srs = ['4326', '3086', '3857']
     enable_requests = ['GetMap', 'GetLegendGraphic', 'GetCapabilities']
     legend_size = (20, 20)
+    use_template = False
+    cache_max_age = None
+
+    # Process wide store of prebuilt map objects, keyed by template key
+    _templates = {}
+    _templates_lock = threading.Lock()
 
     def __init__(self, request, **kwargs):
         """
@@ -27,11 +36,28 @@ class WmsMap(object):
         self.request = request
         self.kwargs = kwargs
 
+        if self.use_template:
+            # Clone prebuilt map and update the request dependent parts
+            template = self.get_template()
+            with timer('map_clone'):
+                self.map_object = template.clone()
+            with timer('update_layers'):
+                self.update_layers()
+        else:
+            self.map_object = self.build_map_object()
+
+    def build_map_object(self):
+        """
+        Creates the mapscript map object with symbols, layers and all map
+        level properties.
+        """
         # Create mapobject
         self.map_object = mapscript.mapObj()
 
-        self.register_symbolset()
-        self.register_layers()
+        with timer('symbolset'):
+            self.register_symbolset()
+        with timer('register_layers'):
+            self.register_layers()
 
         # Set map object properties
         self.map_object.setProjection('init=epsg:3857')
@@ -51,6 +77,64 @@ class WmsMap(object):
         if settings.DEBUG:
             self.map_object.debug = mapscript.MS_ON
 
+        return self.map_object
+
+    def get_template_key(self):
+        """
+        Returns the key under which the prebuilt map object is stored. The
+        key has to cover all request parameters that change the map object
+        apart from what update_layers takes care of. Override this method if
+        layers depend on additional request parameters.
+        """
+        return self.__class__
+
+    def get_template(self):
+        """
+        Returns the prebuilt map object for this map, building it on first
+        use in the current process.
+        """
+        key = self.get_template_key()
+        template = self._templates.get(key)
+        if template is None:
+            with self._templates_lock:
+                template = self._templates.get(key)
+                if template is None:
+                    template = self.build_map_object()
+                    self._templates[key] = template
+        return template
+
+    @classmethod
+    def clear_templates(cls):
+        """
+        Removes all prebuilt map objects, for instance after changing layer
+        classes at runtime.
+        """
+        with cls._templates_lock:
+            cls._templates.clear()
+
+    def update_layers(self):
+        """
+        Updates the request dependent properties of the layers in a map
+        object cloned from the template.
+        """
+        # Keep the layers, they may hold in-memory data sources
+        self.layers = self.get_layers()
+        for layer in self.layers:
+            layer.update_layer(self.map_object.getLayerByName(layer.get_name()))
+
+    def set_layer_extents(self):
+        """
+        Sets the precomputed extents of the layers as wms_extent metadata,
+        so that mapserver does not query the layer data for GetCapabilities
+        requests.
+        """
+        for layer in self.get_layers():
+            extent = layer.get_extent()
+            if extent:
+                self.map_object.getLayerByName(layer.get_name()).setMetaData(
+                    'wms_extent', ' '.join([repr(coord) for coord in extent])
+                )
+
     def get_layers(self):
         """
         Instantiates and returns a list of layers for this map.
@@ -62,8 +146,8 @@ class WmsMap(object):
         """
         Registers all layer objects into a map object.
         """
-        # Get layers
-        layers = self.get_layers()
+        # Get layers, keeping them as they may hold in-memory data sources
+        layers = self.layers = self.get_layers()
 
         # Check for naming consistency
         names = [layer.name for layer in layers]
@@ -78,7 +162,8 @@ class WmsMap(object):
         # Register layers
         for layer in layers:
             # Get layer
-            dispatched_layer = layer.dispatch_by_type()
+            with timer('layer_dispatch', layer=layer.get_name()):
+                dispatched_layer = layer.dispatch_by_type()
 
             # Update symbol index if symbol name was given
             # This is necessary because mapscript links the symbol index from
@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+
+from PIL import Image
+
+from wms.tilegrid import tile_bounds
+
+TILE_SIZE = 256
+
+# Locks for metatiles that are currently being rendered, with the number of
+# requests holding or waiting for each lock.
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def metatile_lock(key):
+    """
+    Context manager serializing the rendering of the metatile with the given
+    key within this process. Requests for the same metatile wait for the
+    first render to finish instead of starting their own.
+    """
+    with _locks_guard:
+        lock, count = _locks.get(key, (None, 0))
+        if lock is None:
+            lock = threading.Lock()
+        _locks[key] = (lock, count + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _locks_guard:
+            lock, count = _locks[key]
+            if count == 1:
+                del _locks[key]
+            else:
+                _locks[key] = (lock, count - 1)
+
+
+class MetaTile(object):
+    """
+    Block of size x size XYZ tiles that is rendered in a single mapserver
+    call. The block is aligned to multiples of size and clipped to the tile
+    grid at low zoom levels. The buffer is a margin in pixels that is
+    rendered around the block and cut off when slicing, it avoids clipped
+    labels and symbols at the metatile edges.
+    """
+
+    def __init__(self, x, y, z, size, buffer=0):
+        self.z = z
+        self.buffer = buffer
+        self.x = x - x % size
+        self.y = y - y % size
+        self.cols = min(size, 2 ** z - self.x)
+        self.rows = min(size, 2 ** z - self.y)
+
+    def tiles(self):
+        """
+        Returns the x, y indices of all tiles in this metatile.
+        """
+        return [
+            (self.x + col, self.y + row)
+            for row in range(self.rows) for col in range(self.cols)
+        ]
+
+    def get_size(self):
+        """
+        Returns width and height of the metatile image in pixels.
+        """
+        return (
+            self.cols * TILE_SIZE + 2 * self.buffer,
+            self.rows * TILE_SIZE + 2 * self.buffer,
+        )
+
+    def get_bounds(self):
+        """
+        Returns the bounds of the metatile image including the buffer.
+        """
+        minx, miny = tile_bounds(self.x, self.y + self.rows - 1, self.z)[:2]
+        maxx, maxy = tile_bounds(self.x + self.cols - 1, self.y, self.z)[2:]
+        margin = self.buffer * (maxx - minx) / (self.cols * TILE_SIZE)
+        return minx - margin, miny - margin, maxx + margin, maxy + margin
+
+    def slice(self, data, imagetype):
+        """
+        Cuts the rendered metatile image into tiles. Returns a dictionary
+        with the encoded tile images keyed by their x, y indices.
+        """
+        image = Image.open(BytesIO(data))
+        image.load()
+        if imagetype == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        tiles = {}
+        for x, y in self.tiles():
+            left = self.buffer + (x - self.x) * TILE_SIZE
+            upper = self.buffer + (y - self.y) * TILE_SIZE
+            tile = image.crop((left, upper, left + TILE_SIZE, upper + TILE_SIZE))
+            output = BytesIO()
+            tile.save(output, imagetype)
+            tiles[(x, y)] = output.getvalue()
+
+        return tiles
@@ -0,0 +1,187 @@
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+from django.http import HttpResponse
+
+# Sent for every timed phase of a request, with the arguments phase,
+# duration (in seconds) and labels.
+phase_timed = Signal()
+
+# Timer of the request that is handled by the current thread
+_local = threading.local()
+
+
+class RequestTimer(object):
+    """
+    Collects the durations of the phases of a single request and forwards
+    them to the metrics sinks. The labels, such as layer and zoom level, are
+    attached to all recorded phases.
+    """
+
+    def __init__(self, sinks, **labels):
+        self.sinks = sinks
+        self.labels = labels
+        self.timings = []
+
+    def record(self, phase, duration, **labels):
+        """
+        Records the duration of a phase and sends it to the sinks.
+        """
+        labels = dict(self.labels, **labels)
+        self.timings.append((phase, duration))
+        for sink in self.sinks:
+            sink.record(phase, duration, labels)
+        phase_timed.send(sender=self.__class__, phase=phase, duration=duration, labels=labels)
+
+    def server_timing(self):
+        """
+        Returns the value of a Server-Timing header with the total duration
+        of each phase in milliseconds.
+        """
+        totals = []
+        durations = {}
+        for phase, duration in self.timings:
+            if phase not in durations:
+                totals.append(phase)
+                durations[phase] = 0
+            durations[phase] += duration
+        return ', '.join('{0};dur={1:.1f}'.format(phase, durations[phase] * 1000) for phase in totals)
+
+
+@contextmanager
+def request_timer(sinks, **labels):
+    """
+    Context manager activating a request timer for the current thread.
+    """
+    previous = getattr(_local, 'timer', None)
+    _local.timer = RequestTimer(sinks, **labels)
+    try:
+        yield _local.timer
+    finally:
+        _local.timer = previous
+
+
+@contextmanager
+def timer(phase, **labels):
+    """
+    Context manager measuring the duration of a phase of the current
+    request. Does nothing if no request timer is active.
+    """
+    current = getattr(_local, 'timer', None)
+    if current is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        current.record(phase, time.time() - start, **labels)
+
+
+class BaseMetricsSink(object):
+    """
+    Base class for metrics sinks, which receive the duration of every timed
+    phase together with its labels.
+    """
+
+    def record(self, phase, duration, labels):
+        """
+        Receives the duration in seconds of a timed phase. Subclasses store
+        or forward it, the base class drops it.
+        """
+
+
+class PrometheusSink(BaseMetricsSink):
+    """
+    Keeps histograms of the phase durations per phase, layer and zoom level
+    in the current process and renders them in the Prometheus text format.
+    Use the view method as django view to expose the metrics.
+    """
+    name = 'wms_phase_duration_seconds'
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name=None, buckets=None):
+        if name is not None:
+            self.name = name
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, duration, labels):
+        key = (phase, str(labels.get('layer', '')), str(labels.get('zoom', '')))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += duration
+            histogram[2] += 1
+
+    def render(self):
+        """
+        Returns the histograms in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP {0} Duration of the phases of WMS requests.'.format(self.name),
+            '# TYPE {0} histogram'.format(self.name),
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        for (phase, layer, zoom), (counts, total, count) in histograms:
+            labels = 'phase="{0}",layer="{1}",zoom="{2}"'.format(
+                self.escape(phase), self.escape(layer), self.escape(zoom)
+            )
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append('{0}_bucket{{{1},le="{2!r}"}} {3}'.format(self.name, labels, bound, bucket_count))
+            lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(self.name, labels, count))
+            lines.append('{0}_sum{{{1}}} {2!r}'.format(self.name, labels, total))
+            lines.append('{0}_count{{{1}}} {2}'.format(self.name, labels, count))
+        return '\n'.join(lines) + '\n'
+
+    def escape(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def view(self, request):
+        """
+        Django view returning the metrics for Prometheus to scrape.
+        """
+        return HttpResponse(self.render(), content_type='text/plain; version=0.0.4')
+
+
+class StatsdSink(BaseMetricsSink):
+    """
+    Sends the phase durations as statsd timers over UDP. The metric names
+    are built from the prefix, the layer, the zoom level and the phase, for
+    instance wms.mylayer.z12.render.
+    """
+    prefix = 'wms'
+
+    def __init__(self, host='localhost', port=8125, prefix=None):
+        self.address = (host, port)
+        if prefix is not None:
+            self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_name(self, phase, labels):
+        parts = [self.prefix]
+        if labels.get('layer'):
+            parts.append(re.sub(r'[^\w\-]', '_', str(labels['layer'])))
+        if labels.get('zoom') not in (None, ''):
+            parts.append('z{0}'.format(labels['zoom']))
+        parts.append(phase)
+        return '.'.join(parts)
+
+    def record(self, phase, duration, labels):
+        message = '{0}:{1:.3f}|ms'.format(self.get_name(phase, labels), duration * 1000)
+        try:
+            self._socket.sendto(message.encode('utf-8'), self.address)
+        except socket.error:
+            pass
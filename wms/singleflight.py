@@ -0,0 +1,253 @@
+import errno
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+# Marks a missing stored result, results themselves may be None
+_missing = object()
+
+
+class _Call(object):
+    """
+    A render call that is in progress, shared by all requests waiting for
+    its result.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls within the current process. The
+    first call for a key runs the function, all calls for the same key that
+    arrive while it is running wait for it and receive the same result.
+
+    The number of calls that were executed and the number of calls that
+    were coalesced into another one are counted for the current process.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Runs func for the given key unless a call for the same key is already
+        in progress, in which case its result is returned. Exceptions raised
+        by func are raised in all waiting calls.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self.run(key, func)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def run(self, key, func):
+        """
+        Executes the function for the leading call of a key.
+        """
+        return self.call(func)
+
+    def call(self, func):
+        """
+        Executes the function and counts the call.
+        """
+        with self._lock:
+            self.calls += 1
+        return func()
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of executed and coalesced calls.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class FileLockSingleFlight(SingleFlight):
+    """
+    Coalesces identical concurrent calls across processes on the same host.
+    Calls are first coalesced within the process, the leading calls of all
+    processes then lock a file named after the hash of the key in the given
+    directory. The process obtaining the lock first runs the function, the
+    processes that were waiting for it read its result from a file.
+
+    The lock and result files of a key are removed once the last waiting
+    process has read the result, so results are only shared with calls
+    that arrived while the function was running. Files left behind by
+    processes that died are removed every cleanup_frequency executed calls
+    once they are older than result_timeout seconds.
+
+    Results are pickled, so the function has to return a picklable value.
+    File locks rely on fcntl and are only available on POSIX systems.
+    """
+    result_timeout = 5
+    cleanup_frequency = 100
+
+    def __init__(self, directory, result_timeout=None):
+        super(FileLockSingleFlight, self).__init__()
+        self.directory = directory
+        if result_timeout is not None:
+            self.result_timeout = result_timeout
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def run(self, key, func):
+        import fcntl
+
+        path = os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        started = time.time()
+
+        lock = self.lock(path + '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if lock is None:
+            # Another process runs the function, register as waiting for
+            # its result so that the result file is kept until it is read.
+            waiting = self.lock(path + '.waiting', fcntl.LOCK_SH)
+            lock = self.lock(path + '.lock', fcntl.LOCK_SH)
+            try:
+                result = self.read_result(path, started)
+            finally:
+                lock.close()
+                waiting.close()
+            self.remove_files(path)
+            if result is not _missing:
+                with self._lock:
+                    self.coalesced += 1
+                return result
+
+            # The other process failed, run the function in turn
+            lock = self.lock(path + '.lock', fcntl.LOCK_EX)
+
+        try:
+            result = self.read_result(path, started)
+            if result is _missing:
+                result = self.call(func)
+                self.write_result(path, result)
+            else:
+                with self._lock:
+                    self.coalesced += 1
+        finally:
+            lock.close()
+        self.remove_files(path)
+
+        if self.stats()['calls'] % self.cleanup_frequency == 0:
+            self.cleanup()
+
+        return result
+
+    def lock(self, path, operation):
+        """
+        Opens and locks the given file. Returns None if a non-blocking lock
+        is not available. Files that were removed while waiting for the lock
+        are opened again.
+        """
+        import fcntl
+
+        while True:
+            handle = open(path, 'a')
+            try:
+                fcntl.flock(handle, operation)
+            except (IOError, OSError) as error:
+                handle.close()
+                if error.errno in (errno.EAGAIN, errno.EACCES):
+                    return None
+                raise
+            try:
+                if os.stat(path).st_ino == os.fstat(handle.fileno()).st_ino:
+                    return handle
+            except OSError:
+                pass
+            handle.close()
+
+    def read_result(self, path, started):
+        """
+        Returns the stored result if it was written after the given time.
+        """
+        try:
+            with open(path + '.result', 'rb') as stored:
+                written, result = pickle.load(stored)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return _missing
+        return result if written >= started else _missing
+
+    def write_result(self, path, result):
+        """
+        Stores the result for the waiting processes.
+        """
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as stored:
+            pickle.dump((time.time(), result), stored, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path + '.result')
+
+    def remove_files(self, path):
+        """
+        Removes the result of a key if no process is waiting for it, and
+        the lock files as well if no process is running the function.
+        """
+        import fcntl
+
+        waiting = self.lock(path + '.waiting', fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if waiting is None:
+            return
+        try:
+            names = ['.result']
+            lock = self.lock(path + '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if lock is not None:
+                names += ['.lock', '.waiting']
+            try:
+                for name in names:
+                    try:
+                        os.remove(path + name)
+                    except OSError:
+                        pass
+            finally:
+                if lock is not None:
+                    lock.close()
+        finally:
+            waiting.close()
+
+    def cleanup(self):
+        """
+        Removes stored results that are older than the result timeout.
+        """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.result'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.result_timeout:
+                    os.remove(path)
+            except OSError:
+                pass
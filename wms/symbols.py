@@ -1,32 +1,48 @@
+import threading
+
 import mapscript
 
 
-class WmsSymbolSet():
+class WmsSymbolSet(object):
     """
     Symbol set for rendering data using different cartograpy styles.
     This includes styles for Points, Lines and Polygons (fills and outlines).
+
+    The preset symbols are created once per process and symbol set class,
+    all instances of a class share the same immutable tuple of symbols.
     """
     symbol_size = 10
-    preset_symbols = []
     custom_symbols = []
 
+    # Process wide store of preset symbols, keyed by symbol set class
+    _preset_symbols = {}
+    _preset_symbols_lock = threading.Lock()
+
     def __init__(self):
         """
         Initiates the preset symbols for the symbolset.
         """
-        self._create_preset_point_symbols()
-        self._create_preset_polygon_symbols()
+        cls = self.__class__
+        if cls not in self._preset_symbols:
+            with self._preset_symbols_lock:
+                if cls not in self._preset_symbols:
+                    self._preset_symbols[cls] = tuple(
+                        self._create_preset_point_symbols() + self._create_preset_polygon_symbols()
+                    )
+        self.preset_symbols = self._preset_symbols[cls]
 
     def get_symbols(self):
         """
-        Returns an array of mapscript symbols.
+        Returns a tuple of mapscript symbols.
         """
-        return self.preset_symbols + self.custom_symbols
+        return self.preset_symbols + tuple(self.custom_symbols)
 
     def _create_preset_point_symbols(self):
         """
-        Initiates preset point symbols.
+        Creates and returns a list of preset point symbols.
         """
+        symbols = []
+
         # Circle symbol
         symb = mapscript.symbolObj('circle')
         symb.type = mapscript.MS_SYMBOL_ELLIPSE
@@ -36,7 +52,7 @@ class WmsSymbolSet():
         symb.setPoints(line)
         symb.sizex = self.symbol_size
         symb.sizey = self.symbol_size
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
 
         # Square symbol
         symb = mapscript.symbolObj('square')
@@ -48,7 +64,7 @@ class WmsSymbolSet():
         symb.setPoints(line)
         symb.sizex = self.symbol_size
         symb.sizey = self.symbol_size
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
 
         # Triangle symbol
         symb = mapscript.symbolObj('triangle')
@@ -60,7 +76,7 @@ class WmsSymbolSet():
         symb.setPoints(line)
         symb.sizex = self.symbol_size
         symb.sizey = self.symbol_size
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
 
         # Cross symbol
         symb = mapscript.symbolObj('cross')
@@ -72,7 +88,7 @@ class WmsSymbolSet():
         symb.setPoints(line)
         symb.sizex = self.symbol_size
         symb.sizey = self.symbol_size
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
 
         # Diagonal symbol
         symb = mapscript.symbolObj('diagonal')
@@ -84,14 +100,20 @@ class WmsSymbolSet():
         symb.setPoints(line)
         symb.sizex = self.symbol_size
         symb.sizey = self.symbol_size
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
+
+        return symbols
 
     def _create_preset_polygon_symbols(self):
         """
-        Create Preset polygon symbols.
+        Creates and returns a list of preset polygon symbols.
         """
+        symbols = []
+
         # Hatch symbol from http://lists.osgeo.org/pipermail/\
         # mapserver-users/2011-September/069884.html
         symb = mapscript.symbolObj('hatch')
         symb.type = mapscript.MS_SYMBOL_HATCH
-        self.preset_symbols.append(symb)
+        symbols.append(symb)
+
+        return symbols
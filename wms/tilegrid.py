@@ -0,0 +1,211 @@
+from math import ceil, floor, log, pi, radians, tan
+
+import numpy
+
+# Radius of the spherical mercator earth in meters
+EARTH_RADIUS = 6378137
+
+# Size of the spherical mercator world in meters
+WORLD_SIZE = 2 * pi * EARTH_RADIUS
+
+# Latitude limit of the spherical mercator projection
+MAX_LATITUDE = 85.0511287798
+
+# Tolerance for rounding errors when converting coordinates to tile indices
+EPSILON = 1e-9
+
+
+def tile_bounds(x, y, z):
+    """
+    Returns the bounds of an XYZ tile in spherical mercator coordinates as
+    a (minx, miny, maxx, maxy) tuple. This is the scalar equivalent of
+    MERCATOR_GRID.tile_bounds for single tiles.
+    """
+    # Setup scale factor for bounds calculations
+    shift = WORLD_SIZE / 2.0
+    scale = WORLD_SIZE / 2**z
+
+    # Calculate bounds
+    minx = x * scale - shift
+    maxx = (x + 1) * scale - shift
+    miny = shift - (y + 1) * scale
+    maxy = shift - y * scale
+
+    return minx, miny, maxx, maxy
+
+
+def lonlat_to_mercator(lon, lat):
+    """
+    Converts longitude and latitude to spherical mercator coordinates.
+    Latitudes are clipped to the limits of the projection.
+    """
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = radians(lon) * EARTH_RADIUS
+    y = log(tan(pi / 4 + radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def tile_range(minx, miny, maxx, maxy, z):
+    """
+    Returns the range of XYZ tiles on zoom level z covering the given bounds
+    in spherical mercator coordinates, as inclusive (minx, miny, maxx, maxy)
+    tile indices. Tiles that only touch the bounds are not included, the
+    range is clipped to the tile grid.
+    """
+    shift = WORLD_SIZE / 2.0
+    scale = WORLD_SIZE / 2**z
+    last = 2**z - 1
+
+    def clip(value):
+        return max(0, min(last, int(value)))
+
+    tile_minx = clip(floor((minx + shift) / scale + EPSILON))
+    tile_miny = clip(floor((shift - maxy) / scale + EPSILON))
+    tile_maxx = max(tile_minx, clip(ceil((maxx + shift) / scale - EPSILON) - 1))
+    tile_maxy = max(tile_miny, clip(ceil((shift - miny) / scale - EPSILON) - 1))
+
+    return tile_minx, tile_miny, tile_maxx, tile_maxy
+
+
+class TileGrid(object):
+    """
+    Regular tile pyramid over a rectangular extent, with vectorized
+    conversions between coordinates and tile indices. All methods accept
+    scalars or numpy arrays of tile indices and zoom levels.
+
+    At zoom level 0, the extent is covered by matrix_width x matrix_height
+    tiles, each zoom level doubles the number of tiles in both directions.
+    Tile rows are counted from the top of the extent, or from the bottom if
+    invert_y is set (as in the TMS specification).
+    """
+
+    # Standardized rendering pixel size in meters (OGC WMTS)
+    PIXEL_SIZE = 0.00028
+
+    def __init__(self, srid, extent, tile_size=256, matrix_width=1, matrix_height=1,
+                 meters_per_unit=1.0, invert_y=False):
+        self.srid = srid
+        self.minx, self.miny, self.maxx, self.maxy = extent
+        self.tile_size = tile_size
+        self.matrix_width = matrix_width
+        self.matrix_height = matrix_height
+        self.meters_per_unit = meters_per_unit
+        self.invert_y = invert_y
+
+    def tile_span(self, z):
+        """
+        Returns the width and height of the tiles on zoom level z in grid
+        units.
+        """
+        factor = numpy.power(2.0, z)
+        return (
+            (self.maxx - self.minx) / (self.matrix_width * factor),
+            (self.maxy - self.miny) / (self.matrix_height * factor),
+        )
+
+    def matrix_size(self, z):
+        """
+        Returns the number of tile columns and rows on zoom level z.
+        """
+        factor = numpy.left_shift(1, numpy.asarray(z, dtype=numpy.int64))
+        return self.matrix_width * factor, self.matrix_height * factor
+
+    def resolution(self, z):
+        """
+        Returns the size of a pixel in grid units on zoom level z.
+        """
+        return self.tile_span(z)[0] / self.tile_size
+
+    def resolutions(self, maxzoom):
+        """
+        Returns an array with the resolutions of zoom levels 0 to maxzoom.
+        """
+        return self.resolution(numpy.arange(maxzoom + 1))
+
+    def scale_denominator(self, z):
+        """
+        Returns the scale denominator of zoom level z, based on the standard
+        rendering pixel size of 0.28 mm.
+        """
+        return self.resolution(z) * self.meters_per_unit / self.PIXEL_SIZE
+
+    def zoom_for_resolution(self, resolution):
+        """
+        Returns the lowest zoom level whose resolution is at least as fine as
+        the given resolution.
+        """
+        zoom = numpy.ceil(numpy.log2(self.resolution(0) / numpy.asarray(resolution, dtype=float)) - EPSILON)
+        return numpy.maximum(zoom, 0).astype(numpy.int64)
+
+    def tile_bounds(self, x, y, z):
+        """
+        Returns the bounds of the given tiles as (minx, miny, maxx, maxy)
+        tuple of arrays.
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        width, height = self.tile_span(z)
+
+        minx = self.minx + x * width
+        if self.invert_y:
+            miny = self.miny + y * height
+        else:
+            miny = self.maxy - (y + 1) * height
+
+        return minx, miny, minx + width, miny + height
+
+    def tile_range(self, minx, miny, maxx, maxy, z):
+        """
+        Returns the inclusive ranges of tile indices covering the given
+        bounds as (minx, miny, maxx, maxy) tuple of arrays. Tiles that only
+        touch the bounds are not included, ranges are clipped to the grid.
+        """
+        width, height = self.tile_span(z)
+        cols, rows = self.matrix_size(z)
+
+        def clip(value, size):
+            return numpy.clip(value, 0, size - 1).astype(numpy.int64)
+
+        tile_minx = clip(numpy.floor((numpy.asarray(minx) - self.minx) / width + EPSILON), cols)
+        tile_maxx = clip(numpy.ceil((numpy.asarray(maxx) - self.minx) / width - EPSILON) - 1, cols)
+        if self.invert_y:
+            tile_miny = clip(numpy.floor((numpy.asarray(miny) - self.miny) / height + EPSILON), rows)
+            tile_maxy = clip(numpy.ceil((numpy.asarray(maxy) - self.miny) / height - EPSILON) - 1, rows)
+        else:
+            tile_miny = clip(numpy.floor((self.maxy - numpy.asarray(maxy)) / height + EPSILON), rows)
+            tile_maxy = clip(numpy.ceil((self.maxy - numpy.asarray(miny)) / height - EPSILON) - 1, rows)
+
+        return (
+            tile_minx, tile_miny,
+            numpy.maximum(tile_minx, tile_maxx), numpy.maximum(tile_miny, tile_maxy),
+        )
+
+    def tiles(self, minx, miny, maxx, maxy, z):
+        """
+        Returns arrays with the x and y indices of all tiles on zoom level z
+        covering the given bounds.
+        """
+        tile_minx, tile_miny, tile_maxx, tile_maxy = self.tile_range(minx, miny, maxx, maxy, z)
+        x, y = numpy.meshgrid(
+            numpy.arange(tile_minx, tile_maxx + 1),
+            numpy.arange(tile_miny, tile_maxy + 1),
+        )
+        return x.ravel(), y.ravel()
+
+    def tile_count(self, minx, miny, maxx, maxy, zooms):
+        """
+        Returns the number of tiles covering the given bounds on each of the
+        zoom levels.
+        """
+        zooms = numpy.asarray(zooms)
+        tile_minx, tile_miny, tile_maxx, tile_maxy = self.tile_range(minx, miny, maxx, maxy, zooms)
+        return (tile_maxx - tile_minx + 1) * (tile_maxy - tile_miny + 1)
+
+
+# Spherical mercator XYZ grid, as used by the tile mode of the WmsView
+MERCATOR_GRID = TileGrid(3857, (-WORLD_SIZE / 2.0, -WORLD_SIZE / 2.0, WORLD_SIZE / 2.0, WORLD_SIZE / 2.0))
+
+# Geographic TMS grid with two tiles on zoom level 0
+GEOGRAPHIC_GRID = TileGrid(
+    4326, (-180.0, -90.0, 180.0, 90.0), matrix_width=2, meters_per_unit=WORLD_SIZE / 360.0, invert_y=True
+)
@@ -0,0 +1,116 @@
+import threading
+import time
+import weakref
+
+from raster.models import RasterTile
+
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+# All tile indexes of this process, used to invalidate them on data changes
+_indexes = weakref.WeakSet()
+
+
+class RasterTileIndex(object):
+    """
+    In-memory index of the existing raster tiles. The index for each zoom
+    level and set of filters is loaded lazily with a single query and kept
+    as a set of encoded tile indices, so that existence checks do not need a
+    database round trip.
+
+    Indexes are invalidated when raster tiles are saved or deleted in the
+    current process. Changes made by other processes or through bulk
+    operations are picked up after timeout seconds if a timeout is set, or
+    by calling invalidate explicitly.
+    """
+    timeout = None
+
+    def __init__(self, timeout=None):
+        if timeout is not None:
+            self.timeout = timeout
+        self._zooms = {}
+        self._lock = threading.Lock()
+        _indexes.add(self)
+
+    def exists(self, x, y, z, **filters):
+        """
+        Returns true if a raster tile with the given indices and matching
+        the given field filters exists. Indices outside of the grid of the
+        zoom level do not exist.
+        """
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return False
+        return (x << z) + y in self.get_zoom_index(z, **filters)
+
+    def is_loaded(self, z, **filters):
+        """
+        Returns true if the index of zoom level z for the given filters is
+        loaded and not expired, so that exists does not query the database.
+        """
+        entry = self._zooms.get((z, tuple(sorted(filters.items()))))
+        return entry is not None and (self.timeout is None or time.time() - entry[0] <= self.timeout)
+
+    def get_zoom_index(self, z, **filters):
+        """
+        Returns the set of encoded indices of all tiles on zoom level z
+        matching the given filters, loading it if necessary. The encoding is
+        only unique within the grid, so tiles outside of it are left out.
+        """
+        key = (z, tuple(sorted(filters.items())))
+        entry = self._zooms.get(key)
+        if entry is None or (self.timeout is not None and time.time() - entry[0] > self.timeout):
+            tiles = RasterTile.objects.filter(tilez=z, **filters).values_list('tilex', 'tiley')
+            size = 2 ** z
+            entry = (time.time(), frozenset((x << z) + y for x, y in tiles if 0 <= x < size and 0 <= y < size))
+            with self._lock:
+                self._zooms[key] = entry
+        return entry[1]
+
+    def invalidate(self, z=None, **filters):
+        """
+        Removes the zoom level indexes matching the given zoom level and
+        filters, or all of them if no arguments are given.
+        """
+        with self._lock:
+            for key in list(self._zooms):
+                key_z, key_filters = key
+                if z is not None and key_z != z:
+                    continue
+                if any(dict(key_filters).get(field, value) != value for field, value in filters.items()):
+                    continue
+                del self._zooms[key]
+
+    def invalidate_tile(self, tile):
+        """
+        Removes the zoom level indexes that could contain the given tile.
+        """
+        with self._lock:
+            for key in list(self._zooms):
+                key_z, key_filters = key
+                if key_z == tile.tilez and all(_may_match(tile, field, value) for field, value in key_filters):
+                    del self._zooms[key]
+
+
+def _may_match(tile, field, value):
+    """
+    Returns false only if the tile is known not to match the filter, for
+    instance for a different filename. Lookups across relations or with
+    lookup types are assumed to match.
+    """
+    if '__' in field or not hasattr(tile, field):
+        return True
+    attribute = getattr(tile, field)
+    if isinstance(attribute, models.Model):
+        return True
+    return attribute == value
+
+
+@receiver(post_save, sender=RasterTile)
+@receiver(post_delete, sender=RasterTile)
+def invalidate_tile_indexes(sender, instance, **kwargs):
+    """
+    Invalidates the tile indexes of this process when a raster tile changes.
+    """
+    for index in list(_indexes):
+        index.invalidate_tile(instance)
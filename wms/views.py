@@ -1,12 +1,54 @@
-from math import pi
+import hashlib
+from calendar import timegm
+from io import BytesIO
 
 import mapscript
 from PIL import Image
 from raster.models import RasterTile
 
-from django.http import HttpResponse
+from django.core.exceptions import ImproperlyConfigured
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, HttpResponseRedirect, JsonResponse,
+    StreamingHttpResponse
+)
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, urlencode
 from django.views.generic import View
+from wms.cache import MemoryTileCache, tile_key, tile_namespace
+from wms.capabilities import get_generation
+from wms.executors import RenderError, RenderQueueFull, RenderTimeout
+from wms.layers import WmsRasterLayer, WmsVectorLayer
 from wms.maps import WmsMap
+from wms.metatiles import MetaTile, metatile_lock
+from wms.metrics import request_timer, timer
+from wms.tilegrid import tile_bounds
+
+# Content type of Mapbox Vector Tiles
+VECTOR_TILE_FORMAT = 'application/vnd.mapbox-vector-tile'
+
+# Process wide store for tiles rendered as part of a metatile. The tiles
+# expire, as they are not removed when the data changes.
+metatile_store = MemoryTileCache(max_entries=4096, timeout=300)
+
+# Encoded empty tiles with their etags, keyed by image type, size and color
+_empty_tiles = {}
+
+
+def get_empty_tile(imagetype, size, color):
+    """
+    Returns the encoded empty tile image and its etag for the given image
+    type, size and fill color. Each empty tile is only encoded once.
+    """
+    key = (imagetype, size, color)
+    if key not in _empty_tiles:
+        im = Image.new("RGBA", size, color)
+        if imagetype == 'JPEG':
+            im = im.convert('RGB')
+        output = BytesIO()
+        im.save(output, imagetype)
+        data = output.getvalue()
+        _empty_tiles[key] = (data, '"{0}"'.format(hashlib.sha1(data).hexdigest()))
+    return _empty_tiles[key]
 
 
 class WmsView(View):
@@ -15,20 +57,92 @@ class WmsView(View):
     """
 
     map_class = None
+    tile_cache = None
+    metatile_size = None
+    metatile_buffer = 64
+    single_flight = None
+    render_executor = None
+    tile_index = None
+    empty_tile_mode = 'image'
+    empty_tile_url = None
+    empty_tile_color = (0, 0, 0, 0)
+    empty_tile_max_age = 60 * 60 * 24 * 365
+    metrics_sinks = []
+    capabilities_cache = None
+    max_width = None
+    max_height = None
+    stream_threshold = 1024 * 1024
+    stream_chunk_size = 64 * 1024
+    server_timing = False
 
     def __init__(self, **kwargs):
-        # Setup mapscript IO stream
-        mapscript.msIO_installStdoutToBuffer()
+        # Setup wms view allowing only GET requests
+        super(WmsView, self).__init__(http_method_names=['get'], **kwargs)
 
-        # Verify that map class has been specified correctly
+        # Verify that map class has been specified correctly, it can also be
+        # passed to as_view
         if not self.map_class or not issubclass(self.map_class, WmsMap):
             raise TypeError(
                 'The map_class attribute is not a subclass of WmsMap. '
                 'Specify a map in map_class attribute.'
             )
 
-        # Setup wms view allowing only GET requests
-        super(WmsView, self).__init__(http_method_names=['get'], **kwargs)
+        if self.empty_tile_mode == 'redirect' and not self.empty_tile_url:
+            raise ImproperlyConfigured('The empty_tile_url is required if the empty_tile_mode is redirect.')
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Times the phases of the request if metrics sinks are attached or the
+        Server-Timing header is enabled.
+        """
+        if not self.metrics_sinks and not self.server_timing:
+            return self.dispatch_request(request, *args, **kwargs)
+
+        with request_timer(self.metrics_sinks, **self.get_metrics_labels()) as timing:
+            with timer('total'):
+                response = self.dispatch_request(request, *args, **kwargs)
+
+        if self.server_timing:
+            response['Server-Timing'] = timing.server_timing()
+
+        return response
+
+    def dispatch_request(self, request, *args, **kwargs):
+        """
+        Returns 503 responses if the render executor is saturated, 504
+        responses if rendering timed out and 502 responses if rendering
+        failed in a worker process.
+        """
+        try:
+            return super(WmsView, self).dispatch(request, *args, **kwargs)
+        except RenderQueueFull:
+            return self.get_queue_full_response(self.render_executor.retry_after)
+        except RenderTimeout:
+            return self.get_timeout_response()
+        except RenderError:
+            return self.get_render_error_response()
+
+    def get_queue_full_response(self, retry_after):
+        """
+        Returns the response for requests rejected by a saturated render
+        executor.
+        """
+        response = HttpResponse('Render queue is full.', status=503, content_type='text/plain')
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def get_timeout_response(self):
+        """
+        Returns the response for requests whose rendering timed out.
+        """
+        return HttpResponse('Rendering timed out.', status=504, content_type='text/plain')
+
+    def get_render_error_response(self):
+        """
+        Returns the response for requests whose rendering failed in a worker
+        process.
+        """
+        return HttpResponse('Rendering failed.', status=502, content_type='text/plain')
 
     def get(self, request, *args, **kwargs):
         """
@@ -36,100 +150,584 @@ class WmsView(View):
         corresponding responses using the attached WmsMap class.
         Responses are mainly images and xml files.
         """
-        # Create response
-        response = HttpResponse()
+        tileparams, format, params = self.get_request_params()
 
-        # Setup wms request object
-        ows_request = mapscript.OWSRequest()
+        # Reject oversized images before rendering
+        if not tileparams and self.is_too_large(params):
+            return self.get_too_large_response()
 
+        # Answer conditional requests before building the map
+        with timer('validation'):
+            layers = self.get_requested_layers(params)
+            version = self.get_data_version(layers)
+            last_modified = version and version[0]
+            etag = self.get_etag(params, version)
+        if self.is_not_modified(etag, last_modified):
+            return self.get_not_modified_response(etag, last_modified, self.get_cache_max_age(layers))
+
+        if tileparams:
+            response = self.get_tile_response(format, params, *tileparams)
+            return self.finalize_response(response, format, etag, last_modified, layers)
+
+        data, contenttype = self.render(params)
+        with timer('response'):
+            response = self.get_render_response(data, contenttype)
+
+        return self.finalize_response(response, self.get_requested_format(params), etag, last_modified, layers, data)
+
+    def get_request_params(self):
+        """
+        Returns the tile indices, the tile format and the OWS parameters of
+        the request. The tile indices and format are None for WMS requests.
+        """
         # If tile kwargs were provided, add tile parameters to request
         tileparams = self.tilemode()
 
-        if tileparams:
-            # Get image format from url
-            format = {'.png': 'image/png',
-                      '.jpg': 'image/jpeg'}[self.kwargs.get('format')]
+        if not tileparams:
+            return None, None, self.request.GET
+
+        # Get image format from url
+        format = {'.png': 'image/png',
+                  '.jpg': 'image/jpeg',
+                  '.pbf': VECTOR_TILE_FORMAT}[self.kwargs.get('format')]
+        tilebounds = self.get_tile_bounds(*tileparams)
+        return tileparams, format, self.get_tile_request_data(format, tilebounds)
+
+    def is_too_large(self, params):
+        """
+        Returns true if the requested image is wider than max_width or
+        higher than max_height.
+        """
+        params = dict((param.upper(), value) for param, value in params.items())
+        for param, limit in (('WIDTH', self.max_width), ('HEIGHT', self.max_height)):
+            try:
+                if limit is not None and int(params.get(param, 0)) > limit:
+                    return True
+            except ValueError:
+                # Let mapserver report invalid sizes
+                pass
+        return False
+
+    def get_too_large_response(self):
+        """
+        Returns the response for requests exceeding the maximum image size.
+        """
+        return HttpResponseBadRequest(
+            'The maximum image size is {0}x{1} pixels.'.format(self.max_width or '-', self.max_height or '-'),
+            content_type='text/plain',
+        )
+
+    def get_render_response(self, data, contenttype):
+        """
+        Returns the response for rendered data. Data larger than the
+        stream_threshold is streamed in chunks of stream_chunk_size bytes,
+        each chunk is sliced from the rendered data when it is sent.
+        """
+        if self.stream_threshold is None or len(data) < self.stream_threshold:
+            return HttpResponse(data, content_type=contenttype)
+
+        chunks = (data[start:start + self.stream_chunk_size] for start in range(0, len(data), self.stream_chunk_size))
+        response = StreamingHttpResponse(chunks, content_type=contenttype)
+        response['Content-Length'] = str(len(data))
+        return response
+
+    def finalize_response(self, response, format, etag, last_modified, layers, data=None):
+        """
+        Sets validators and cache headers on successful responses in the
+        requested format, or returns a 304 response if the rendered content
+        matches the client copy. Empty tiles have their own headers. The
+        rendered data has to be given for streaming responses.
+        """
+        if response.status_code != 200 or response.has_header('ETag'):
+            return response
+
+        if data is None:
+            data = response.content
+        if not self.is_requested_document(response['Content-Type'], format, data):
+            return response
+
+        if etag is None:
+            etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+            if self.is_not_modified(etag, None):
+                return self.get_not_modified_response(etag, last_modified, self.get_cache_max_age(layers))
+        self.set_cache_headers(response, etag, last_modified, self.get_cache_max_age(layers))
+
+        return response
+
+    def get_requested_format(self, params):
+        """
+        Returns the content type requested by the given OWS parameters, or
+        None for capabilities requests.
+        """
+        params = dict((param.upper(), value) for param, value in params.items())
+        request_type = params.get('REQUEST', '').lower()
+        if request_type == 'getcapabilities':
+            return None
+        return params.get('INFO_FORMAT' if request_type == 'getfeatureinfo' else 'FORMAT')
+
+    def is_requested_document(self, contenttype, format, data):
+        """
+        Returns true if the response is in the requested format, rather than
+        a service exception or another error document. Responses without a
+        requested format have to be capabilities documents.
+        """
+        if format is None:
+            return self.is_capabilities_document(data, contenttype)
+        return contenttype.split(';')[0].strip().lower() == format.split(';')[0].strip().lower()
+
+    def get_tile_response(self, format, params, x, y, z):
+        """
+        Returns the response for a tile, served from the tile cache if
+        possible.
+        """
+        # Return tile from cache if available
+        store = self.get_tile_store()
+        if store:
+            cache_key = self.get_tile_cache_key(x, y, z)
+            with timer('cache_lookup'):
+                data = store.get(cache_key)
+            if data is not None:
+                return HttpResponse(data, content_type=format)
+
+        # Vector tiles are queried directly from the database
+        if format == VECTOR_TILE_FORMAT:
+            with timer('render'):
+                data = self.render_vector_tile(params, x, y, z)
+            if store:
+                store.set(cache_key, data)
+            return HttpResponse(data, content_type=format)
+
+        # Return empty image if tile cant be found
+        with timer('tile_exists'):
+            exists = self.tile_exists(x, y, z)
+        if not exists:
+            return self.get_empty_tile_response(format)
+        elif self.use_metatiles():
+            data, contenttype = self.render_metatile(format, x, y, z)
+        else:
+            data, contenttype = self.render(params)
+
+            # Store rendered tile in cache, error documents are not cached
+            if store and contenttype == format:
+                store.set(cache_key, data)
 
-            # Return empty image if tile cant be found
-            if not self.tile_exists(*tileparams):
-                # Get image type and size
-                imagetype = 'PNG' if format == 'image/png' else 'JPEG'
-                imagesize = 256, 256
-                response['Content-Type'] = format
+        with timer('response'):
+            return HttpResponse(data, content_type=contenttype)
+
+    def render_vector_tile(self, params, x, y, z):
+        """
+        Returns the Mapbox Vector Tile with the requested vector layers.
+        Each layer is encoded by a single query, the tile is the
+        concatenation of the encoded layers.
+        """
+        layers = [layer for layer in self.get_requested_layers(params) if isinstance(layer, WmsVectorLayer)]
+        return b''.join([layer.get_mvt(x, y, z) for layer in layers])
 
-                # Create image and save it to response
-                im = Image.new("RGBA", imagesize, (0, 0, 0, 0))
-                im.save(response, imagetype)
+    def get_requested_layers(self, params):
+        """
+        Returns instances of the layer classes of the map that are requested
+        by the LAYERS parameter, or of all layers if no layers were given.
+        """
+        layers = [layer(self.request, **self.kwargs) for layer in self.map_class.layer_classes]
+        names = dict((param.upper(), value) for param, value in params.items()).get('LAYERS')
+        if names:
+            names = names.split(',')
+            layers = [layer for layer in layers if layer.get_name() in names]
+        return layers
+
+    def get_data_version(self, layers):
+        """
+        Returns the latest modification date and the summed data generation
+        of the data in the given layers, or None if the version is not known
+        for any of them. The date is None if all layers are empty.
+        """
+        versions = [layer.get_data_version() for layer in layers]
+        if not versions or None in versions:
+            return None
+        dates = [date for date, generation in versions if date is not None]
+        return max(dates) if dates else None, sum(generation for date, generation in versions)
 
+    def get_etag(self, params, version):
+        """
+        Returns an etag derived from the request parameters and the data
+        version, or None if the data version is not known.
+        """
+        if version is None:
+            return None
+        last_modified, generation = version
+        version = '{0}|{1}|{2}'.format(
+            self.get_render_key(params), last_modified.isoformat() if last_modified else '', generation
+        )
+        return '"{0}"'.format(hashlib.sha1(version.encode('utf-8')).hexdigest())
+
+    def get_cache_max_age(self, layers):
+        """
+        Returns the smallest max-age of the requested layers, falling back to
+        the max-age of the map.
+        """
+        ages = [layer.cache_max_age for layer in layers if layer.cache_max_age is not None]
+        if ages:
+            return min(ages)
+        return self.map_class.cache_max_age
+
+    def is_not_modified(self, etag, last_modified):
+        """
+        Returns true if the client copy matches the given validators.
+        """
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            if etag is None:
+                return False
+            etags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in etags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in etags]
+
+        if_modified_since = parse_http_date_safe(self.request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is not None and last_modified is not None:
+            return timegm(last_modified.utctimetuple()) <= if_modified_since
+
+        return False
+
+    def get_not_modified_response(self, etag, last_modified, max_age=None):
+        """
+        Returns a 304 response with the given validators and max-age.
+        """
+        response = HttpResponseNotModified()
+        self.set_cache_headers(response, etag, last_modified, max_age)
+        return response
+
+    def set_cache_headers(self, response, etag, last_modified, max_age):
+        """
+        Sets the ETag, Last-Modified and Cache-Control headers.
+        """
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+        if max_age is not None:
+            patch_cache_control(response, max_age=max_age)
+
+    def get_empty_tile_response(self, format):
+        """
+        Returns the response for tiles that do not exist. Depending on the
+        empty_tile_mode, this is a shared precomputed empty image, an empty
+        204 response or a redirect to the empty_tile_url.
+        """
+        if self.empty_tile_mode == 'empty':
+            response = HttpResponse(status=204)
+        elif self.empty_tile_mode == 'redirect':
+            response = HttpResponseRedirect(self.empty_tile_url.format(format=self.kwargs.get('format')))
+        else:
+            # Get image type and size
+            imagetype = 'PNG' if format == 'image/png' else 'JPEG'
+            data, etag = get_empty_tile(imagetype, (256, 256), self.empty_tile_color)
+
+            if self.is_not_modified(etag, None):
+                response = self.get_not_modified_response(etag, None)
+                patch_cache_control(response, public=True, max_age=self.empty_tile_max_age)
                 return response
+
+            response = HttpResponse(data, content_type=format)
+            response['ETag'] = etag
+
+        patch_cache_control(response, public=True, max_age=self.empty_tile_max_age)
+
+        return response
+
+    def render(self, params):
+        """
+        Renders an OWS request with the given parameters through the map
+        class. Returns the rendered data and its content type. Identical
+        concurrent requests are coalesced if single_flight is set, and the
+        rendering is sent to worker processes if render_executor is set.
+        """
+        if self.render_executor:
+            def func():
+                return self.render_executor.render(self.get_render_job(params))
+        else:
+            def func():
+                return self.render_ows(params)
+
+        if self.capabilities_cache and self.get_request_type(params) == 'getcapabilities':
+            return self.get_capabilities(params, func)
+
+        with timer('render'):
+            if self.single_flight:
+                return self.single_flight.do(self.get_render_key(params), func)
             else:
-                tilebounds = self.get_tile_bounds(*tileparams)
-
-                # Get layer name
-                layers = self.kwargs.get('layers')
-
-                # Setup wms parameter object
-                request_data = {
-                    'SERVICE': 'WMS',
-                    'REQUEST': 'GetMap',
-                    'VERSION': '1.1.1',
-                    'TRANSPARENT': 'true',
-                    'HEIGHT': '256',
-                    'WIDTH': '256',
-                    'SRS': 'EPSG:3857',
-                    'FORMAT': format,
-                    'LAYERS': layers,
-                    'BBOX': tilebounds,
-                }
-
-                request.GET = dict(request.GET.items() + request_data.items())
+                return func()
+
+    def get_capabilities(self, params, func):
+        """
+        Returns the capabilities document from the capabilities cache, or
+        renders it with the given function and stores it. Service exceptions
+        and other error documents are not cached.
+        """
+        key = self.get_capabilities_key(params)
+        with timer('cache_lookup'):
+            cached = self.capabilities_cache.get(key)
+        if cached is not None:
+            contenttype, data = cached.split(b'\n', 1)
+            return data, contenttype.decode('ascii')
+
+        with timer('render'):
+            if self.single_flight:
+                data, contenttype = self.single_flight.do(self.get_render_key(params), func)
+            else:
+                data, contenttype = func()
+
+        if self.is_capabilities_document(data, contenttype):
+            self.capabilities_cache.set(key, contenttype.encode('ascii') + b'\n' + data)
+
+        return data, contenttype
+
+    def is_capabilities_document(self, data, contenttype):
+        """
+        Returns true if the rendered data is a capabilities document. WMS
+        1.3.0 service exceptions are sent as text/xml, so the root element
+        is checked as well.
+        """
+        if 'xml' not in contenttype or 'se_xml' in contenttype:
+            return False
+        return b'Capabilities' in data and b'ServiceExceptionReport' not in data
+
+    def get_capabilities_key(self, params):
+        """
+        Returns the capabilities cache key for the given OWS parameters. The
+        key covers the map class and its configuration, the endpoint, the
+        parameters such as the version and the data generation of the layer
+        models. Changes that do not send model signals are not part of the
+        key, so caches shared between processes should have a timeout.
+        """
+        layers = [layer(self.request, **self.kwargs) for layer in self.map_class.layer_classes]
+        config = '|'.join([
+            self.get_render_key(params),
+            self.map_class.title,
+            ','.join(self.map_class.srs),
+            ','.join(self.map_class.enable_requests),
+            ','.join([layer.get_name() for layer in layers]),
+        ])
+        generation = get_generation(set(layer.model for layer in layers))
+        return 'capabilities/{0}/{1}/{2}'.format(
+            self.map_class.__name__.lower(),
+            generation,
+            hashlib.sha1(config.encode('utf-8')).hexdigest(),
+        )
+
+    def get_render_job(self, params):
+        """
+        Returns a description of the render job for the given OWS parameters
+        that can be sent to the worker processes of a render executor.
+        """
+        return {
+            'view': '{0}.{1}'.format(self.__class__.__module__, self.__class__.__name__),
+            'params': dict(params.items()),
+            'kwargs': self.kwargs,
+            'path': self.request.get_full_path(),
+            'host': self.request.get_host(),
+            'secure': self.request.is_secure(),
+        }
+
+    def get_render_key(self, params):
+        """
+        Returns a key identifying the rendered output for the given OWS
+        parameters. Parameter names are case insensitive for mapserver, so
+        they are normalized to upper case.
+        """
+        map_path = '{0}.{1}'.format(self.map_class.__module__, self.map_class.__name__)
+        onlineresource = self.request.build_absolute_uri().split('?')[0]
+        params = sorted((param.upper(), value) for param, value in params.items())
+        return '{0}|{1}|{2}'.format(map_path, onlineresource, urlencode(params))
+
+    def render_ows(self, params):
+        """
+        Renders an OWS request through a new instance of the map class.
+        GetMap requests are drawn directly into an image, all other request
+        types are dispatched through the mapserver OWS interface.
+        """
+        # Setup wms request object
+        ows_request = mapscript.OWSRequest()
 
         # Set ows parameters from request data
-        for param, value in request.GET.items():
+        for param, value in params.items():
             ows_request.setParameter(param, value)
 
         # Instantiate WmsMap class
-        self.wmsmap = self.map_class(request, **kwargs)
+        with timer('map_construction'):
+            self.wmsmap = self.map_class(self.request, **self.kwargs)
 
         # Dynamically use host for declaring service endpoint
-        onlineresource = request.build_absolute_uri().split('?')[0] + '?'
+        onlineresource = self.request.build_absolute_uri().split('?')[0] + '?'
         self.wmsmap.map_object.setMetaData('wms_onlineresource',
                                            onlineresource)
 
-        # Dispatch map rendering
-        self.wmsmap.map_object.OWSDispatch(ows_request)
+        request_type = self.get_request_type(params)
+        if request_type == 'getmap':
+            try:
+                return self.draw_map(ows_request)
+            except mapscript.MapServerError:
+                # Let the OWS dispatcher create the service exception
+                pass
+        elif request_type == 'getcapabilities':
+            # Avoid extent queries by mapserver
+            with timer('layer_extents'):
+                self.wmsmap.set_layer_extents()
+
+        return self.dispatch_ows(ows_request)
+
+    def get_request_type(self, params):
+        """
+        Returns the lower case OWS request type of the given parameters.
+        """
+        return dict((param.upper(), value) for param, value in params.items()).get('REQUEST', '').lower()
 
-        # Strip buffer from headers
-        mapscript.msIO_stripStdoutBufferContentHeaders()
+    def draw_map(self, ows_request):
+        """
+        Draws a GetMap request into an in-memory image. This does not use
+        the mapscript stdout buffer, so it is safe to use from concurrent
+        threads.
+        """
+        self.wmsmap.map_object.loadOWSParameters(ows_request)
+        with timer('draw'):
+            image = self.wmsmap.map_object.draw()
+        with timer('encode'):
+            return image.getBytes(), image.format.mimetype
 
-        # Store contenttype
-        contenttype = mapscript.msIO_stripStdoutBufferContentType()
+    def dispatch_ows(self, ows_request):
+        """
+        Dispatches an OWS request and reads the result from the mapscript
+        stdout buffer. The buffer is installed for the current thread only
+        and reset after reading.
+        """
+        # Setup mapscript IO stream
+        mapscript.msIO_installStdoutToBuffer()
 
-        # Write data to response
-        response.write(mapscript.msIO_getStdoutBufferBytes())
+        try:
+            # Dispatch map rendering
+            with timer('dispatch'):
+                self.wmsmap.map_object.OWSDispatch(ows_request)
 
-        # Set contenttype
-        response['Content-Type'] = contenttype
+            # Strip buffer from headers
+            mapscript.msIO_stripStdoutBufferContentHeaders()
 
-        return response
+            # Store contenttype
+            contenttype = mapscript.msIO_stripStdoutBufferContentType()
 
-    def get_tile_bounds(self, x, y, z):
+            return mapscript.msIO_getStdoutBufferBytes(), contenttype
+        finally:
+            mapscript.msIO_resetHandlers()
+
+    def get_metrics_labels(self):
         """
-        Calculates tile bounding box from Tile Map Service XYZ indices.
+        Returns the labels attached to the timings of this request, which
+        are the requested layers and the zoom level in tile mode. Names that
+        are not layers of the map are labeled as other, so that clients can
+        not create arbitrary label values.
+        """
+        layers = self.kwargs.get('layers')
+        if layers is None:
+            layers = dict((param.upper(), value) for param, value in self.request.GET.items()).get('LAYERS', '')
+
+        known = [layer(self.request, **self.kwargs).get_name() for layer in self.map_class.layer_classes]
+        labels = []
+        for name in layers.split(','):
+            if not name:
+                continue
+            label = name if name in known else 'other'
+            if label not in labels:
+                labels.append(label)
+        return {'layer': ','.join(labels), 'zoom': self.kwargs.get('z', '')}
+
+    def get_tile_request_data(self, format, tilebounds, width=256, height=256):
         """
-        # Setup scale factor for bounds calculations
-        res = 2 * pi * 6378137
-        shift = res / 2.0
-        scale = res / 2**z
+        Returns the GetMap parameters for rendering the given bounds in tile
+        mode, including the parameters of the original request.
+        """
+        # Setup wms parameter object
+        request_data = dict(self.request.GET.items())
+        request_data.update({
+            'SERVICE': 'WMS',
+            'REQUEST': 'GetMap',
+            'VERSION': '1.1.1',
+            'TRANSPARENT': 'true',
+            'HEIGHT': str(height),
+            'WIDTH': str(width),
+            'SRS': 'EPSG:3857',
+            'FORMAT': format,
+            'LAYERS': self.kwargs.get('layers'),
+            'BBOX': tilebounds,
+        })
+        return request_data
+
+    def get_tile_store(self):
+        """
+        Returns the cache used to look up and store rendered tiles. In
+        metatile mode, a process wide memory cache is used to keep the
+        sibling tiles if no tile cache was specified.
+        """
+        if self.tile_cache:
+            return self.tile_cache
+        elif self.use_metatiles():
+            return metatile_store
 
-        # Calculate bounds
-        minx = x * scale - shift
-        maxx = (x + 1) * scale - shift
-        miny = shift - (y + 1) * scale
-        maxy = shift - y * scale
+    def use_metatiles(self):
+        """
+        Returns true if tiles are rendered as metatiles. Raster layers are
+        bound to the data of a single tile, so maps with raster layers are
+        always rendered tile by tile. Read-only tile caches can not keep the
+        sibling tiles, so their views render tile by tile as well.
+        """
+        if not self.metatile_size or getattr(self.tile_cache, 'readonly', False):
+            return False
+        return not any(issubclass(layer, WmsRasterLayer) for layer in self.map_class.layer_classes)
 
+    def render_metatile(self, format, x, y, z):
+        """
+        Renders the metatile containing the requested tile, stores its
+        existing tiles in the tile store and returns the requested one.
+        """
+        store = self.get_tile_store()
+        metatile = MetaTile(x, y, z, self.metatile_size, self.metatile_buffer)
+        keys = dict((tile, self.get_tile_cache_key(tile[0], tile[1], z)) for tile in metatile.tiles())
+
+        with metatile_lock(keys[(metatile.x, metatile.y)]):
+            # The tile might have been rendered while waiting for the lock
+            data = store.peek(keys[(x, y)])
+            if data is not None:
+                return data, format
+
+            bounds = ','.join([repr(coord) for coord in metatile.get_bounds()])
+            width, height = metatile.get_size()
+            data, contenttype = self.render(self.get_tile_request_data(format, bounds, width, height))
+
+            # Return error documents unchanged
+            if contenttype != format:
+                return data, contenttype
+
+            imagetype = 'PNG' if format == 'image/png' else 'JPEG'
+            tiles = metatile.slice(data, imagetype)
+            existing = self.get_existing_tiles(metatile)
+            for tile, tiledata in tiles.items():
+                # Missing siblings are left to the empty tile response
+                if tile == (x, y) or tile in existing:
+                    store.set(keys[tile], tiledata)
+
+        return tiles[(x, y)], format
+
+    def get_tile_cache_key(self, x, y, z):
+        """
+        Returns the tile cache key for the requested tile. The key depends on
+        the map class, the layers, the tile indices, the format and on any
+        additional query parameters such as the cartography.
+        """
+        namespace = tile_namespace(self.map_class, self.request.GET.lists())
+        return tile_key(namespace, self.kwargs.get('layers', ''), z, x, y, self.kwargs.get('format'))
+
+    def get_tile_bounds(self, x, y, z):
+        """
+        Calculates tile bounding box from Tile Map Service XYZ indices.
+        """
         # Convert bounds to query string
-        return ','.join([repr(coord) for coord in [minx, miny, maxx, maxy]])
+        return ','.join([repr(coord) for coord in tile_bounds(x, y, z)])
 
     def tilemode(self):
         """
@@ -149,9 +747,77 @@ class WmsView(View):
         """
         Returns true if the requested XYZ tile exists.
         """
+        if self.tile_index:
+            return self.tile_index.exists(x, y, z, filename=self.kwargs.get('layers', ''))
+
         return RasterTile.objects.filter(
             tilex=x,
             tiley=y,
             tilez=z,
             filename=self.kwargs.get('layers', '')
         ).exists()
+
+    def get_existing_tiles(self, metatile):
+        """
+        Returns the set of x, y indices of the tiles of a metatile that
+        exist, using a single query.
+        """
+        if self.tile_index:
+            return set(
+                tile for tile in metatile.tiles()
+                if self.tile_index.exists(tile[0], tile[1], metatile.z, filename=self.kwargs.get('layers', ''))
+            )
+
+        return set(RasterTile.objects.filter(
+            tilex__gte=metatile.x,
+            tilex__lt=metatile.x + metatile.cols,
+            tiley__gte=metatile.y,
+            tiley__lt=metatile.y + metatile.rows,
+            tilez=metatile.z,
+            filename=self.kwargs.get('layers', '')
+        ).values_list('tilex', 'tiley'))
+
+
+class WmsStyleView(View):
+    """
+    Returns the cartography of the vector layers of a map as a style
+    document for vector tile clients. The tile_url is the url pattern of
+    the vector tiles, where {layers} is replaced by the layer names and the
+    {z}, {x} and {y} placeholders are left to the client.
+    """
+
+    map_class = None
+    tile_url = '/tile/{layers}/{z}/{x}/{y}.pbf'
+    source_name = 'wms'
+
+    def __init__(self, **kwargs):
+        super(WmsStyleView, self).__init__(http_method_names=['get'], **kwargs)
+
+        # Verify that map class has been specified correctly
+        if not self.map_class or not issubclass(self.map_class, WmsMap):
+            raise TypeError(
+                'The map_class attribute is not a subclass of WmsMap. '
+                'Specify a map in map_class attribute.'
+            )
+
+    def get(self, request, *args, **kwargs):
+        layers = [layer(request, **kwargs) for layer in self.map_class.layer_classes]
+        layers = [layer for layer in layers if isinstance(layer, WmsVectorLayer)]
+
+        tile_url = self.tile_url.replace('{layers}', ','.join([layer.get_name() for layer in layers]))
+        if '://' not in tile_url:
+            # Keep the placeholders, build_absolute_uri would quote them
+            tile_url = '{0}://{1}{2}'.format(request.scheme, request.get_host(), tile_url)
+
+        style_layers = []
+        for layer in layers:
+            style_layers.extend(layer.get_style_layers(self.source_name))
+
+        return JsonResponse({
+            'version': 8,
+            'name': self.map_class.title,
+            'sources': {
+                self.source_name: {'type': 'vector', 'tiles': [tile_url]},
+            },
+            'layers': style_layers,
+        })